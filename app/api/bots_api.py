@@ -11,6 +11,7 @@ from app.database.chroma_manager import chroma_manager
 from app.schemas import bot_schemas, mcp_schemas
 from app.schemas.bot_schemas import LogMessage
 from app.core.websocket_manager import websocket_manager
+from app.core import agent_orchestrator
 
 
 # --- Log Broadcasting Manager ---
@@ -217,6 +218,7 @@ def update_bot_mcp_servers_associations(
         raise HTTPException(status_code=404, detail="Bot not found.")
     
     updated_bot = crud_bots.update_bot_mcp_servers(db=db, bot_id=bot_id, mcp_associations=mcp_associations)
+    agent_orchestrator.invalidate_bot_tools(bot_id)
     
     return updated_bot
 
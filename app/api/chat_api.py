@@ -1,6 +1,8 @@
+import asyncio
+import contextlib
 import logging
 import json
-from typing import Union
+from typing import Any, Dict, Set, Union
 from datetime import datetime, timezone
 
 from fastapi import APIRouter, Depends, HTTPException, Request
@@ -21,6 +23,25 @@ router = APIRouter()
 
 CHAT_CONTEXT_EXPIRATION_S = 600
 
+# Sent with the token stream: no caching, and no buffering by a reverse proxy
+# (nginx otherwise holds SSE frames back until its buffer fills).
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def _sse_frame(payload: Dict[str, Any]) -> bytes:
+    """
+    Frames a JSON payload as one SSE event, already encoded: StreamingResponse sends
+    bytes as-is instead of encoding every str frame. json.dumps escapes non-ASCII,
+    so the ASCII encode can't fail.
+    """
+    return b"data: " + json.dumps(payload).encode("ascii") + b"\n\n"
+
+
+def _retrieve_task_result(task: asyncio.Task) -> None:
+    """Done callback marking a task's exception as retrieved, whether or not it is awaited later."""
+    if not task.cancelled():
+        task.exception()
+
 
 @router.post(
     "/process_message",
@@ -112,7 +133,7 @@ async def stream_response(
     
     # --- FIX: CONSTRUCT FULL HISTORY (History + Current Message) ---
     # The history must include the current message for the Synthesizer to see it
-    history_data = [msg.model_dump() for msg in reconstructed_request.history]
+    history_data = chat_schemas.dump_chat_history(reconstructed_request.history)
     
     # RE-APPLY TIME & USER CONTEXT for Consistency
     # We must format the current message exactly as the orchestrator did.
@@ -133,49 +154,72 @@ async def stream_response(
     if not bot:
             raise HTTPException(status_code=404, detail=f"Bot with id {bot_id} not found.")
     
-    global_settings = crud_settings.get_global_settings(db)
+    global_settings = crud_settings.get_global_settings_cached(db)
+
+    # The playbook load (disk) doesn't depend on the tool results, so it runs
+    # while the plan executes instead of after it.
+    playbook_task = asyncio.create_task(agent_orchestrator.load_bot_playbook(bot_id))
+    # The task is only awaited once the response body is iterated, which may never happen
+    # (client gone before the stream starts): retrieve its outcome so a failure isn't
+    # reported as "Task exception was never retrieved".
+    playbook_task.add_done_callback(_retrieve_task_result)
 
     tool_results = []
     if plan_data and tool_definitions:
         plan_result = chat_schemas.PlannerResult.model_validate(plan_data)
         logger.info(f"Executing pre-computed plan for message {message_id}")
-        tool_results = await agent_orchestrator.execute_tool_plan(
-            db=db, bot_id=bot_id, plan_result=plan_result, tool_definitions=tool_definitions
-        )
-        logger.info(f"Plan execution finished. Results: {tool_results}")
+        try:
+            tool_results = await agent_orchestrator.execute_tool_plan(
+                db=db, bot_id=bot_id, plan_result=plan_result, tool_definitions=tool_definitions
+            )
+        except BaseException:
+            playbook_task.cancel()
+            raise
+        logger.info(f"Plan execution finished with {len(tool_results)} result(s) for message {message_id}")
+        logger.debug("Plan execution results: %s", tool_results)
     else:
         logger.info(f"No execution plan found for message {message_id}, proceeding directly to synthesizer.")
 
     async def event_generator():
-        final_response_content = ""
+        # Chunks are collected and joined once at the end; `+=` per token
+        # re-copies the whole response so far on every chunk.
+        response_chunks = []
         stream_successful = False
         try:
             logger.info(f"Starting synthesis phase for message {message_id}")
             
-            async for chunk in agent_orchestrator.run_synthesis_phase(
+            synthesis_stream = await agent_orchestrator.run_synthesis_phase(
                 bot=bot,
                 global_settings=global_settings,
                 history=history_data, # Now contains the full history + current message with context
-                tool_results=tool_results
-            ):
-                if await request.is_disconnected():
-                    logger.warning("Client disconnected, stopping stream.")
-                    break
-                
-                final_response_content += chunk
-                yield f"data: {json.dumps({'content': chunk})}\n\n"
+                tool_results=tool_results,
+                playbook_content=await playbook_task
+            )
+            # On disconnect (or cancellation) the whole generator chain is closed
+            # immediately, down to the LLM HTTP stream, so generation stops too.
+            async with contextlib.aclosing(synthesis_stream):
+                async for chunk in synthesis_stream:
+                    if await request.is_disconnected():
+                        logger.warning("Client disconnected, stopping stream.")
+                        break
+                    
+                    response_chunks.append(chunk)
+                    yield _sse_frame({'content': chunk})
             
             logger.info(f"Synthesis stream finished for message {message_id}")
             stream_successful = True
 
         except Exception as e:
             logger.error(f"Error during streaming for message {message_id}: {e}", exc_info=True)
-            error_message = json.dumps({"error": "An error occurred while generating the response."})
-            yield f"data: {error_message}\n\n"
+            yield _sse_frame({"error": "An error occurred while generating the response."})
         finally:
+            if not playbook_task.done():
+                playbook_task.cancel()
             logger.info(f"Cleaning up Redis context for message_id: {message_id}")
             redis_client.delete(context_key)
 
+            final_response_content = "".join(response_chunks)
+
             # --- MODIFICATION: Trigger ACE learning cycle ---
             if stream_successful and final_response_content:
                 logger.info(f"ACE: Triggering learning cycle for bot {bot_id} on successful interaction.")
@@ -188,23 +232,39 @@ async def stream_response(
                     interaction_context_json=json.dumps(interaction_context)
                 )
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    return StreamingResponse(event_generator(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 
-@router.post("/archive", status_code=202, summary="Archive a conversation")
-async def archive_conversation(
-    request: chat_schemas.ArchiveRequest,
-    db: Session = Depends(sql_session.get_db)
-):
+# Strong references to in-flight archiving tasks (asyncio only keeps weak ones)
+_ARCHIVE_TASKS: Set[asyncio.Task] = set()
+
+
+async def shutdown_archive_tasks(timeout: float = 10.0) -> None:
     """
-    Analyzes a conversation and saves key facts to the user's long-term memory.
+    Gives in-flight archiving tasks a chance to finish, then cancels the rest.
+    Called on application shutdown so no task is destroyed while still pending.
     """
-    logger.info(f"Archivist received conversation for user {request.user_display_name}")
+    if not _ARCHIVE_TASKS:
+        return
+    done, pending = await asyncio.wait(set(_ARCHIVE_TASKS), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning(f"Cancelled {len(pending)} unfinished archiving task(s) on shutdown.")
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def _run_archive_in_background(request: chat_schemas.ArchiveRequest) -> None:
+    """
+    Runs the Archivist and saves its notes. Executed after the endpoint has answered,
+    so it uses its own DB session and never raises.
+    """
+    db = sql_session.SessionLocal()
     try:
         bot = crud_bots.get_bot(db, request.bot_id)
         if not bot:
             logger.error(f"Archivist: Bot with ID {request.bot_id} not found.")
-            return {"message": "Accepted, but bot not found."}
+            return
 
         global_settings = crud_settings.get_global_settings(db)
 
@@ -216,7 +276,7 @@ async def archive_conversation(
 
         if not archivist_decision.notes_to_create:
             logger.info("Archivist found nothing to save.")
-            return {"message": "Accepted. No notes to create."}
+            return
 
         user_id_str = str(request.user_id)
         user_profile = crud_user_profiles.get_or_create_profile(
@@ -233,8 +293,21 @@ async def archive_conversation(
             )
         
         logger.info(f"Successfully created {len(archivist_decision.notes_to_create)} notes for user {request.user_display_name}")
-        return {"message": f"Accepted. Created {len(archivist_decision.notes_to_create)} notes."}
 
     except Exception as e:
         logger.error(f"An error occurred during conversation archiving: {e}", exc_info=True)
-        return {"message": "Accepted, but an internal error occurred during processing."}
\ No newline at end of file
+    finally:
+        db.close()
+
+
+@router.post("/archive", status_code=202, summary="Archive a conversation")
+async def archive_conversation(request: chat_schemas.ArchiveRequest):
+    """
+    Accepts a conversation for archiving. The Archivist (an LLM call) and the note
+    creation run in the background: archiving is not on the user-visible path.
+    """
+    logger.info(f"Archivist received conversation for user {request.user_display_name}")
+    task = asyncio.create_task(_run_archive_in_background(request))
+    _ARCHIVE_TASKS.add(task)
+    task.add_done_callback(_ARCHIVE_TASKS.discard)
+    return {"message": "Accepted. Archiving in progress."}
@@ -4,6 +4,7 @@
 import logging
 from fastapi import APIRouter, HTTPException, Depends
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 # Import correct de la fonction de listing depuis le nouveau manager
 from app.core.llm_manager import list_available_models
@@ -21,7 +22,7 @@ async def get_models(db: Session = Depends(sql_session.get_db)):
     Supports both Ollama and OpenAI-compatible providers via LiteLLM.
     """
     # 1. Récupérer la configuration globale pour savoir quel serveur interroger
-    settings = crud_settings.get_settings(db)
+    settings = await run_in_threadpool(crud_settings.get_global_settings, db)
     
     # Valeurs par défaut si les settings n'existent pas encore (premier démarrage)
     server_url = "http://host.docker.internal:11434"
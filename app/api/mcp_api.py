@@ -15,6 +15,7 @@ from mcp_use import MCPClient
 
 from app.database.sql_session import get_db, SessionLocal
 from app.database import crud_mcp, crud_bots
+from app.core import agent_orchestrator, mcp_pool
 from app.schemas import mcp_schemas
 
 logger = logging.getLogger(__name__)
@@ -178,7 +179,10 @@ def update_mcp_server(
                 detail=f"An MCP server with the name '{server_update.name}' already exists.",
             )
 
-    return crud_mcp.update_mcp_server(db=db, server_id=server_id, server_update=server_update)
+    updated_server = crud_mcp.update_mcp_server(db=db, server_id=server_id, server_update=server_update)
+    # The server may be shared by several bots: drop every cached tool list
+    agent_orchestrator.invalidate_bot_tools()
+    return updated_server
 
 @router.delete("/mcp-servers/{server_id}", response_model=mcp_schemas.MCPServerInDB)
 def delete_mcp_server(server_id: int, db: Session = Depends(get_db)):
@@ -187,6 +191,9 @@ def delete_mcp_server(server_id: int, db: Session = Depends(get_db)):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="MCP server not found"
         )
+    agent_orchestrator.invalidate_bot_tools()
+    # Close the deleted server's pooled connection instead of keeping it for the process lifetime
+    mcp_pool.discard(server_id)
     return db_server
 
 @router.post("/mcp-servers/{server_id}/discover-tools", response_model=mcp_schemas.MCPServerInDB)
@@ -199,6 +206,8 @@ async def discover_and_cache_mcp_tools(server_id: int, db: Session = Depends(get
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="MCP server not found")
 
     await _discover_and_update_if_needed(db_server, db)
+    # A manual discovery also refreshes what the orchestrator sees on the next turn
+    agent_orchestrator.invalidate_bot_tools()
     
     return crud_mcp.get_mcp_server(db, server_id=server_id)
 
@@ -6,9 +6,7 @@ import logging
 
 from pydantic import ValidationError
 
-import ollama
-from ollama import ResponseError
-
+from app.core.llm_manager import invalidate_models_cache, list_available_models
 from app.database.sql_session import get_db
 from app.schemas.settings_schema import (
     GlobalSettings, 
@@ -78,12 +76,14 @@ def patch_global_settings(
 )
 async def get_llm_models_list(
     host_url: Optional[str] = None, 
+    refresh: bool = False,
     db: Session = Depends(get_db)
 ):
     """
     Fetches the list of available models from an LLM server.
     Supports both Ollama and cloud providers via LiteLLM.
     If host_url is not provided, it will use the decisional_llm_server_url from global settings.
+    With refresh=true the cached list of that server is dropped first (UI's explicit refresh).
     """
     url_to_use = host_url
 
@@ -98,14 +98,14 @@ async def get_llm_models_list(
             raise HTTPException(status_code=400, detail="LLM host URL is missing.")
 
     try:
-        # Import the list_available_models function
-        from app.core.llm_manager import list_available_models, detect_provider_from_url
-        
         # Get API key from global settings if available
         api_key = None
         if settings and settings.decisional_llm_api_key:
             api_key = str(settings.decisional_llm_api_key)
         
+        if refresh:
+            invalidate_models_cache(url_to_use)
+
         # List models using the unified function
         models_data = await list_available_models(url_to_use, api_key)
         
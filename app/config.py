@@ -24,6 +24,10 @@ class Settings(BaseSettings):
     # Paramètres pour Redis (utilisé pour Celery et le cache de session de chat)
     REDIS_URL: str = "redis://redis:6379/0"
 
+    # Exécution des étapes indépendantes d'un plan d'outils en parallèle.
+    # À désactiver si certains outils ont des effets de bord dépendant de l'ordre.
+    PARALLEL_TOOL_EXECUTION: bool = True
+
     @property
     def database_url(self) -> str:
         """
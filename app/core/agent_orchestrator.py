@@ -1,21 +1,25 @@
 import logging
-from typing import Union, List, Dict, Any, Optional, AsyncGenerator
+from typing import Union, List, Dict, Any, Optional, AsyncGenerator, Tuple
 import asyncio
+import functools
+import hashlib
 import json
 import os
 import re
+import threading
+import time
 from datetime import datetime, timezone
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
-# --- NEW: MCP-Use Import & HTTPX for Exceptions ---
-from mcp_use import MCPClient
+# --- HTTPX for Exceptions ---
 import httpx
 # ---------------------------
 
 from sqlalchemy.orm import Session
 
-from app.core import llm_manager
+from app.config import settings
+from app.core import llm_manager, mcp_pool
 # NOUVEAU: Import du MemoryManager
 from app.core.memory_manager import MemoryManager
 
@@ -28,8 +32,11 @@ from app.schemas.chat_schemas import (
     ClarifyResponse,
     AcknowledgeAndExecuteResponse,
     SynthesizeResponse,
+    PlanStep,
     PlannerResult,
-    ChatMessage
+    ExtractAndPlanResult,
+    ChatMessage,
+    dump_chat_history
 )
 
 # Database CRUD Imports
@@ -45,6 +52,50 @@ except ImportError:
 
 logger = logging.getLogger("app.core.agent_orchestrator")
 
+# --- MCP Circuit Breaker ---
+# Maps server_id -> (consecutive network failures, monotonic time of the last failure or probe).
+# While a server is "open", its tool calls fail fast instead of paying retries + backoff.
+# Once the cooldown has elapsed the breaker is "half-open": a single probe call goes through,
+# and the others keep failing fast until that probe succeeds.
+_BREAKERS: Dict[int, Tuple[int, float]] = {}
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_COOLDOWN_S = 30.0
+
+# --- Adaptive MCP Tool Call Timeouts ---
+# Maps (server_id, tool_name) -> EWMA of successful call latencies (seconds).
+# A call may take up to TOOL_TIMEOUT_EWMA_FACTOR x its usual latency, so one degraded
+# server can't stall a turn for the full ceiling once its normal latency is known.
+# The floor is generous: tool latencies vary a lot, and a timed out call is not retried.
+_TOOL_LATENCY_EWMA: Dict[Tuple[int, str], float] = {}
+TOOL_LATENCY_EWMA_ALPHA = 0.2
+TOOL_TIMEOUT_EWMA_FACTOR = 3.0
+TOOL_TIMEOUT_MIN_S = 30.0
+TOOL_TIMEOUT_MAX_S = 120.0
+
+# --- ACE Playbook Cache ---
+# Maps bot_id -> (playbook file mtime, formatted prompt content)
+_PLAYBOOK_CACHE: Dict[int, Tuple[float, str]] = {}
+_PLAYBOOK_CACHE_LOCK = threading.Lock()
+
+# --- MCP Tool Discovery Cache ---
+# Maps bot_id -> (monotonic time of discovery, tool definitions).
+# Saves one `tools/list` round trip per MCP server on every user message.
+_TOOLS_CACHE: Dict[int, Tuple[float, List[Dict[str, Any]]]] = {}
+TOOLS_CACHE_TTL_S = 60.0
+# Maps (server_id, tool_name) -> inputSchema serialized to JSON at discovery time,
+# so prompt building only concatenates the selected tools' strings.
+_TOOL_SCHEMA_JSON: Dict[Tuple[int, str], str] = {}
+
+# --- MCP Tool Result Cache (opt-in) ---
+# Maps a hash of (server, tool, arguments, tool configuration) -> (monotonic expiry, step result).
+# Only tools listed in the bot<->server association's `configuration["tool_cache"]`
+# ({"tool_name": ttl_seconds}) are cached, so stateful tools are never memoized.
+_TOOL_RESULT_CACHE: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+TOOL_RESULT_CACHE_MAX_ENTRIES = 512
+
+# Matches the `$ref.steps[N]...` placeholders the Planner uses for inter-step dependencies
+_STEP_REF_PATTERN = re.compile(r"\$ref\.steps\[(\d+)\]")
+
 # --- Internal Pydantic models for response validation ---
 
 class GatekeeperResponse(BaseModel):
@@ -54,6 +105,11 @@ class GatekeeperResponse(BaseModel):
 class ToolIdentifierResponse(BaseModel):
     required_tools: List[str]
 
+# JSON schemas used to constrain the structured LLM calls (computed once)
+_GATEKEEPER_SCHEMA = GatekeeperResponse.model_json_schema()
+_TOOL_IDENTIFIER_SCHEMA = ToolIdentifierResponse.model_json_schema()
+_EXTRACT_AND_PLAN_SCHEMA = ExtractAndPlanResult.model_json_schema()
+
 # --- Helpers ---
 
 def _clean_json_response(raw_response: str) -> str:
@@ -84,18 +140,108 @@ def _clean_json_response(raw_response: str) -> str:
     return cleaned.strip()
 
 def _load_bot_playbook_content(bot_id: int) -> str:
+    """
+    Returns the bot's ACE playbook formatted for prompt injection.
+    The formatted string is cached and only rebuilt when the file's mtime changes.
+    Called both from the event loop and from worker threads, hence the lock.
+    """
     if not ACE_INSTALLED:
         return ""
     playbook_path = f"/app/data/playbooks/{bot_id}.json"
-    if not os.path.exists(playbook_path):
+    try:
+        mtime = os.stat(playbook_path).st_mtime
+    except OSError:
         return ""
+
+    with _PLAYBOOK_CACHE_LOCK:
+        cached = _PLAYBOOK_CACHE.get(bot_id)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
     try:
         playbook = Playbook.from_file(playbook_path)
-        return playbook.as_prompt()
+        content = playbook.as_prompt()
     except Exception as e:
         logger.error(f"Failed to load ACE playbook for bot {bot_id}: {e}")
         return ""
 
+    with _PLAYBOOK_CACHE_LOCK:
+        _PLAYBOOK_CACHE[bot_id] = (mtime, content)
+    return content
+
+async def load_bot_playbook(bot_id: int) -> str:
+    """Loads the bot's playbook in a worker thread; disk I/O must not block the event loop."""
+    return await asyncio.to_thread(_load_bot_playbook_content, bot_id)
+
+def _breaker_is_open(server_id: int) -> bool:
+    """Returns True if the server failed too often recently and should be skipped."""
+    fail_count, last_failure_ts = _BREAKERS.get(server_id, (0, 0.0))
+    return fail_count >= BREAKER_FAILURE_THRESHOLD and time.monotonic() - last_failure_ts < BREAKER_COOLDOWN_S
+
+def _breaker_allow_request(server_id: int) -> bool:
+    """
+    Returns True if a call to the server may proceed. In half-open state, only the
+    first caller gets through (the probe timestamp restarts the cooldown for the others).
+    """
+    fail_count, last_failure_ts = _BREAKERS.get(server_id, (0, 0.0))
+    if fail_count < BREAKER_FAILURE_THRESHOLD:
+        return True
+    if time.monotonic() - last_failure_ts < BREAKER_COOLDOWN_S:
+        return False
+    _BREAKERS[server_id] = (fail_count, time.monotonic())
+    return True
+
+def _breaker_record_failure(server_id: int) -> None:
+    fail_count, _ = _BREAKERS.get(server_id, (0, 0.0))
+    _BREAKERS[server_id] = (fail_count + 1, time.monotonic())
+
+def _breaker_record_success(server_id: int) -> None:
+    _BREAKERS.pop(server_id, None)
+
+def _tool_call_timeout(server_id: int, tool_name: str) -> float:
+    ewma = _TOOL_LATENCY_EWMA.get((server_id, tool_name))
+    if ewma is None:
+        return TOOL_TIMEOUT_MAX_S
+    return min(TOOL_TIMEOUT_MAX_S, max(TOOL_TIMEOUT_MIN_S, TOOL_TIMEOUT_EWMA_FACTOR * ewma))
+
+def _record_tool_latency(server_id: int, tool_name: str, latency_s: float) -> None:
+    key = (server_id, tool_name)
+    previous = _TOOL_LATENCY_EWMA.get(key)
+    _TOOL_LATENCY_EWMA[key] = latency_s if previous is None else (
+        TOOL_LATENCY_EWMA_ALPHA * latency_s + (1 - TOOL_LATENCY_EWMA_ALPHA) * previous
+    )
+
+def _group_plan_into_waves(plan_result: PlannerResult, parallel: bool = True) -> List[List[Any]]:
+    """
+    Splits the plan into "waves" of steps that can run concurrently.
+    A step depends on every step number it references via `$ref.steps[N]`; steps whose
+    dependencies are all completed form the next wave. With `parallel=False`, every step
+    is its own wave, in plan order.
+    """
+    ordered_steps = sorted(plan_result.plan, key=lambda x: x.step)
+    if not parallel:
+        return [[step] for step in ordered_steps]
+
+    step_numbers = {step.step for step in ordered_steps}
+    dependencies = {
+        id(step): {int(n) for n in _STEP_REF_PATTERN.findall(json.dumps(step.arguments, default=str))} & (step_numbers - {step.step})
+        for step in ordered_steps
+    }
+
+    waves = []
+    remaining = ordered_steps
+    while remaining:
+        pending_numbers = {step.step for step in remaining}
+        wave = [step for step in remaining if not (dependencies[id(step)] & pending_numbers)]
+        if not wave:
+            # Circular references: fall back to plan order for whatever is left
+            waves.extend([step] for step in remaining)
+            break
+        waves.append(wave)
+        wave_ids = {id(step) for step in wave}
+        remaining = [step for step in remaining if id(step) not in wave_ids]
+    return waves
+
 def _get_current_time_str() -> str:
     """Returns the current UTC time formatted for prompt injection."""
     return datetime.now(timezone.utc).strftime("%A, %B %d, %Y, %H:%M UTC")
@@ -104,6 +250,61 @@ def _format_message_with_context(content: str, user_name: str, user_id: str, tim
     """Formats a message to include time and strict user identification."""
     return f"[{timestamp_str}] {user_name} (ID: {user_id}): {content}"
 
+# --- Cached Prompt Builders ---
+# The keys are the exact fields injected into each prompt, so an edited bot
+# (new name/personality) simply maps to a new entry; no explicit invalidation needed.
+
+# The Gatekeeper prompt ends with the current time, which changes every minute:
+# only the bot-dependent part before it is cached, the time is appended per call.
+_GATEKEEPER_PROMPT_HEAD, _GATEKEEPER_PROMPT_TAIL = prompts.GATEKEEPER_SYSTEM_PROMPT.split("{current_time}")
+_GATEKEEPER_PROMPT_TAIL = _GATEKEEPER_PROMPT_TAIL.format()
+
+@functools.lru_cache(maxsize=1024)
+def _gatekeeper_prompt_head(bot_name: str) -> str:
+    return _GATEKEEPER_PROMPT_HEAD.format(bot_name=bot_name)
+
+def _gatekeeper_prompt(bot_name: str, current_time: str) -> str:
+    return f"{_gatekeeper_prompt_head(bot_name)}{current_time}{_GATEKEEPER_PROMPT_TAIL}"
+
+@functools.lru_cache(maxsize=1024)
+def _clarifier_prompt(bot_name: str, bot_personality: str) -> str:
+    return prompts.CLARIFIER_SYSTEM_PROMPT.format(bot_name=bot_name, bot_personality=bot_personality)
+
+@functools.lru_cache(maxsize=1024)
+def _acknowledger_prompt(bot_personality: str) -> str:
+    return prompts.ACKNOWLEDGER_SYSTEM_PROMPT.format(bot_personality=bot_personality)
+
+@functools.lru_cache(maxsize=256)
+def _format_tools_list(tools_key: Tuple[Tuple[str, str, Tuple[str, ...]], ...]) -> str:
+    """Renders the Tool Identifier's tools list from (name, description, argument names) tuples."""
+    return "\n".join(
+        f"- {name}: {desc} (Arguments: {', '.join(arg_keys) if arg_keys else 'None'})"
+        for name, desc, arg_keys in tools_key
+    )
+
+def _tool_schema_json(tool: Dict[str, Any]) -> str:
+    """Returns the tool's inputSchema as JSON, pre-serialized at discovery when available."""
+    schema_json = _TOOL_SCHEMA_JSON.get((tool.get('server_id'), tool.get('name')))
+    if schema_json is None:
+        schema_json = json.dumps(tool.get('inputSchema', {}))
+    return schema_json
+
+def _takes_no_arguments(tool: Dict[str, Any]) -> bool:
+    """True if the tool's inputSchema declares neither properties nor required arguments."""
+    schema = tool.get('inputSchema') or {}
+    return not schema.get('properties') and not schema.get('required')
+
+def _tools_list_key(tools: List[Dict[str, Any]]) -> Tuple[Tuple[str, str, Tuple[str, ...]], ...]:
+    """Builds the hashable cache key of a toolset for _format_tools_list."""
+    return tuple(
+        (
+            tool.get('name', 'unknown'),
+            tool.get('description', 'No description'),
+            tuple((tool.get('inputSchema') or {}).get('properties') or ()),
+        )
+        for tool in tools
+    )
+
 # --- Orchestrator Logic ---
 
 async def process_user_message(
@@ -119,206 +320,237 @@ async def process_user_message(
     if not bot:
         return StopResponse(reason=f"Bot with ID {request.bot_id} not found.")
     
-    global_settings = crud_settings.get_global_settings(db)
+    global_settings = crud_settings.get_global_settings_cached(db)
     
     # Calculate timestamps once for consistency
     current_time_str = _get_current_time_str()
 
-    # 1. LOAD PLAYBOOK
-    playbook_content = _load_bot_playbook_content(bot.id)
+    # 1. START INDEPENDENT WORK
+    # Tool discovery and playbook loading don't depend on the Gatekeeper's decision:
+    # start them now so their I/O overlaps with the Gatekeeper LLM call.
+    tools_task = asyncio.create_task(get_available_tools_for_bot(db, bot.id))
+    playbook_task = asyncio.create_task(load_bot_playbook(bot.id))
 
-    # 2. MEMORY RETRIEVAL (NEW)
-    # Initialize Mem0 for this bot
-    memory_client = MemoryManager.get_memory_client(bot, global_settings)
-    # Search for relevant memories based on the user's current message
-    # We use a unique ID combining Bot + Discord User ID to isolate memories
-    user_mem_id = f"{request.user_id}" 
-    relevant_memories = MemoryManager.get_memories(memory_client, user_id=user_mem_id, query=request.message_content)
+    try:
+        # 2. MEMORY RETRIEVAL (NEW)
+        # Mem0 is synchronous (Chroma connection, embedding call, vector search):
+        # it runs in a worker thread so the event loop keeps serving other turns.
+        # The config is built here: it reads the ORM objects, and the Session (shared with
+        # tools_task) must not be used from another thread. Only Mem0 itself is offloaded.
+        # Initialize Mem0 for this bot
+        mem0_config = MemoryManager.build_memory_config(bot, global_settings)
+        memory_client = await asyncio.to_thread(MemoryManager.create_memory_client, mem0_config)
+        # Search for relevant memories based on the user's current message
+        # We use a unique ID combining Bot + Discord User ID to isolate memories
+        user_mem_id = f"{request.user_id}" 
+        relevant_memories = await asyncio.to_thread(
+            MemoryManager.get_memories, memory_client, user_id=user_mem_id, query=request.message_content
+        )
     
-    if relevant_memories:
-        logger.info(f"Found relevant memories for user {request.user_id}: {relevant_memories[:50]}...")
-    else:
-        logger.info("No relevant long-term memories found.")
+        if relevant_memories:
+            logger.info(f"Found relevant memories for user {request.user_id}: {relevant_memories[:50]}...")
+        else:
+            logger.info("No relevant long-term memories found.")
 
-    # 3. CONSTRUCT HISTORY WITH TIME AWARENESS
+        # 3. CONSTRUCT HISTORY WITH TIME AWARENESS
     
-    # Format the current message with explicit Metadata (Time + User ID)
-    # This ensures the LLM knows EXACTLY who is speaking and when.
-    formatted_current_content = _format_message_with_context(
-        content=request.message_content,
-        user_name=request.user_display_name,
-        user_id=str(request.user_id),
-        timestamp_str=current_time_str
-    )
+        # Format the current message with explicit Metadata (Time + User ID)
+        # This ensures the LLM knows EXACTLY who is speaking and when.
+        formatted_current_content = _format_message_with_context(
+            content=request.message_content,
+            user_name=request.user_display_name,
+            user_id=str(request.user_id),
+            timestamp_str=current_time_str
+        )
     
-    # Inject Memory Context if available
-    final_message_content = formatted_current_content
-    if relevant_memories:
-         final_message_content = f"""[CONTEXTUAL MEMORY START]
+        # Inject Memory Context if available
+        final_message_content = formatted_current_content
+        if relevant_memories:
+             final_message_content = f"""[CONTEXTUAL MEMORY START]
 The following facts are recalled from previous conversations with this user:
 {relevant_memories}
 [CONTEXTUAL MEMORY END]
 
 {formatted_current_content}"""
 
-    # Create the proper ChatMessage object
-    current_message = ChatMessage(
-        role="user", 
-        content=final_message_content, 
-        name=request.user_display_name
-    )
+        # Create the proper ChatMessage object
+        current_message = ChatMessage(
+            role="user", 
+            content=final_message_content, 
+            name=request.user_display_name
+        )
     
-    full_history_dicts = [msg.model_dump() for msg in request.history]
-    full_history_dicts.append(current_message.model_dump())
-
-    # --- MEMORY UPDATE (FIRE AND FORGET) ---
-    # We schedule the memory update to run in background so we don't block the response
-    # Mem0 will extract facts from "request.message_content" (original)
-    asyncio.create_task(
-        MemoryManager.add_interaction(
-            memory_client, 
-            user_id=user_mem_id, 
-            user_message=request.message_content, 
-            bot_response="" # We add response later if needed, mostly user facts matter
+        full_history_dicts = dump_chat_history(request.history)
+        full_history_dicts.append(current_message.model_dump())
+
+        # --- MEMORY UPDATE (FIRE AND FORGET) ---
+        # We schedule the memory update to run in background so we don't block the response
+        # Mem0 will extract facts from "request.message_content" (original)
+        asyncio.create_task(
+            MemoryManager.add_interaction(
+                memory_client, 
+                user_id=user_mem_id, 
+                user_message=request.message_content, 
+                bot_response="" # We add response later if needed, mostly user facts matter
+            )
         )
-    )
 
-    # --- 1. Gatekeeper Step ---
-    bypass_gatekeeper = request.is_direct_message or request.is_direct_mention
-    if not bypass_gatekeeper:
-        logger.info("Running Gatekeeper...")
-        decisional_config = llm_manager.resolve_llm_config(bot, global_settings, llm_manager.LLM_CATEGORY_DECISIONAL)
+        # --- 1. Gatekeeper Step ---
+        bypass_gatekeeper = request.is_direct_message or request.is_direct_mention
+        if not bypass_gatekeeper:
+            logger.info("Running Gatekeeper...")
+            decisional_config = llm_manager.resolve_llm_config(bot, global_settings, llm_manager.LLM_CATEGORY_DECISIONAL)
         
-        # Inject Current Time into Gatekeeper Prompt
-        gatekeeper_prompt = prompts.GATEKEEPER_SYSTEM_PROMPT.format(
-            bot_name=bot.name,
-            current_time=current_time_str
-        )
-        response_str = await llm_manager.call_llm(decisional_config, gatekeeper_prompt, full_history_dicts, json_mode=True)
+            # Inject Current Time into Gatekeeper Prompt
+            gatekeeper_prompt = _gatekeeper_prompt(bot.name, current_time_str)
+            response_str = await llm_manager.call_llm(
+                decisional_config, gatekeeper_prompt, full_history_dicts, json_mode=True, json_schema=_GATEKEEPER_SCHEMA,
+                coalesce=True
+            )
         
-        cleaned_response = _clean_json_response(response_str)
-        try:
-            gatekeeper_decision = GatekeeperResponse.model_validate_json(cleaned_response)
-            if not gatekeeper_decision.should_respond:
-                return StopResponse(reason=gatekeeper_decision.reason)
-        except Exception as e:
-            logger.error(f"Gatekeeper error: {e}")
-            return StopResponse(reason="Gatekeeper error")
-
-    # --- 2. Tool Identification Step ---
-    available_tools = await get_available_tools_for_bot(db, bot.id)
-    tools_config = llm_manager.resolve_llm_config(bot, global_settings, llm_manager.LLM_CATEGORY_TOOLS)
+            cleaned_response = _clean_json_response(response_str)
+            try:
+                gatekeeper_decision = GatekeeperResponse.model_validate_json(cleaned_response)
+                if not gatekeeper_decision.should_respond:
+                    return StopResponse(reason=gatekeeper_decision.reason)
+            except Exception as e:
+                logger.error(f"Gatekeeper error: {e}")
+                return StopResponse(reason="Gatekeeper error")
+
+        # --- 2. Tool Identification Step ---
+        available_tools = await tools_task
+        # Fast path: without any tool there is nothing to identify, skip the LLM round trip
+        if not available_tools:
+            return SynthesizeResponse(final_response_stream_url=f"/api/chat/stream/{request.message_id}")
+        playbook_content = await playbook_task
+        tools_config = llm_manager.resolve_llm_config(bot, global_settings, llm_manager.LLM_CATEGORY_TOOLS)
     
-    tools_entries = []
-    for tool in available_tools:
-        name = tool.get('name', 'unknown')
-        desc = tool.get('description', 'No description')
-        input_schema = tool.get('inputSchema', {})
-        properties = input_schema.get('properties', {})
-        arg_keys = list(properties.keys()) if properties else []
-        args_str = ", ".join(arg_keys) if arg_keys else "None"
-        tools_entries.append(f"- {name}: {desc} (Arguments: {args_str})")
-        
-    tools_list_str = "\n".join(tools_entries)
+        tools_list_str = _format_tools_list(_tools_list_key(available_tools))
     
-    # Inject Current Time into Tool Identifier Prompt
-    tool_id_prompt = prompts.TOOL_IDENTIFIER_SYSTEM_PROMPT.format(
-        tools_list=tools_list_str,
-        ace_playbook=playbook_content,
-        current_time=current_time_str
-    )
+        # Inject Current Time into Tool Identifier Prompt
+        tool_id_prompt = prompts.TOOL_IDENTIFIER_SYSTEM_PROMPT.format(
+            tools_list=tools_list_str,
+            ace_playbook=playbook_content,
+            current_time=current_time_str
+        )
     
-    try:
-        response_str = await llm_manager.call_llm(tools_config, tool_id_prompt, full_history_dicts, json_mode=True)
-    except Exception as llm_error:
-        logger.error(f"Tool Identifier error: {llm_error}")
-        response_str = "{}"
+        try:
+            response_str = await llm_manager.call_llm(
+                tools_config, tool_id_prompt, full_history_dicts, json_mode=True, json_schema=_TOOL_IDENTIFIER_SCHEMA,
+                coalesce=True
+            )
+        except Exception as llm_error:
+            logger.error(f"Tool Identifier error: {llm_error}")
+            response_str = "{}"
 
-    cleaned_response = _clean_json_response(response_str)
-    try:
-        tool_id_result = ToolIdentifierResponse.model_validate_json(cleaned_response)
-        available_tool_names = {tool['name'] for tool in available_tools}
-        required_tool_names = [name for name in tool_id_result.required_tools if name in available_tool_names]
-    except Exception:
-        required_tool_names = []
+        cleaned_response = _clean_json_response(response_str)
+        try:
+            tool_id_result = ToolIdentifierResponse.model_validate_json(cleaned_response)
+            available_tool_names = {tool['name'] for tool in available_tools}
+            required_tool_names = [name for name in tool_id_result.required_tools if name in available_tool_names]
+        except Exception:
+            required_tool_names = []
         
-    if not required_tool_names:
-        return SynthesizeResponse(final_response_stream_url=f"/api/chat/stream/{request.message_id}")
-
-    # --- 3. Parameter Extraction ---
-    required_tool_definitions = [tool for tool in available_tools if tool.get("name") in required_tool_names]
-    tool_schemas_str = ""
-    for td in required_tool_definitions:
-        tool_schemas_str += f"- Tool: {td['name']}\n  Schema: {json.dumps(td.get('inputSchema', {}))}\n"
-    
-    # Param Extractor prompt doesn't strictly need time, but we use the standard helper anyway
-    param_ext_prompt = prompts.PARAMETER_EXTRACTOR_SYSTEM_PROMPT.format(tool_schemas=tool_schemas_str)
-    response_str = await llm_manager.call_llm(tools_config, param_ext_prompt, full_history_dicts, json_mode=True)
+        if not required_tool_names:
+            return SynthesizeResponse(final_response_stream_url=f"/api/chat/stream/{request.message_id}")
 
-    cleaned_response = _clean_json_response(response_str)
-    try:
-        from app.schemas.chat_schemas import ParameterExtractorResult
-        param_ext_result = ParameterExtractorResult.model_validate_json(cleaned_response)
-        
-        # Filter hallucinations
-        param_ext_result.extracted_parameters = {
-            k: v for k, v in param_ext_result.extracted_parameters.items() 
-            if k in required_tool_names
-        }
-        param_ext_result.missing_parameters = [
-            m for m in param_ext_result.missing_parameters 
-            if m.tool in required_tool_names
-        ]
-    except Exception as e:
-        return StopResponse(reason="Parameter extraction error")
+        # Built once: used for filtering, hallucination checks and plan validation below
+        identified_tool_names_set = frozenset(required_tool_names)
 
-    if param_ext_result.missing_parameters:
+        # The Acknowledger doesn't depend on the plan: run it concurrently with the (much slower)
+        # extraction + planning call. It is cancelled if the turn ends with a Stop/Clarify instead.
         output_config = llm_manager.resolve_llm_config(bot, global_settings, llm_manager.LLM_CATEGORY_OUTPUT_CLIENT)
-        clarifier_prompt = prompts.CLARIFIER_SYSTEM_PROMPT.format(bot_name=bot.name, bot_personality=bot.personality)
-        technical_question = param_ext_result.clarification_question or "I need more information."
-        clarifier_messages = [{"role": "user", "content": f"Rephrase this technical question: {technical_question}"}]
-        user_facing_question = await llm_manager.call_llm(output_config, clarifier_prompt, clarifier_messages)
-        return ClarifyResponse(message=user_facing_question)
-
-    # --- 4. Planning ---
-    allowed_tools_str = ", ".join(required_tool_names)
-    clean_params_input = json.dumps(param_ext_result.extracted_parameters)
-
-    # Inject Current Time into Planner Prompt
-    planner_prompt = prompts.PLANNER_SYSTEM_PROMPT.format(
-        ace_playbook=playbook_content,
-        allowed_tools=allowed_tools_str,
-        current_time=current_time_str
-    )
-    planner_messages = [{"role": "user", "content": f"Create a plan for these tools and parameters: {clean_params_input}"}]
-    response_str = await llm_manager.call_llm(tools_config, planner_prompt, planner_messages, json_mode=True)
+        ack_messages = [{"role": "user", "content": "Generate an acknowledgement."}]
+        ack_task = asyncio.create_task(
+            llm_manager.call_llm(output_config, _acknowledger_prompt(bot.personality), ack_messages)
+        )
 
-    cleaned_response = _clean_json_response(response_str)
-    try:
-        plan_result = PlannerResult.model_validate_json(cleaned_response)
-        if not plan_result.plan:
-            raise ValueError("Empty plan")
-    except Exception:
-        return StopResponse(reason="Planning error")
-
-    # --- 4.5 Validation ---
-    identified_tool_names_set = set(required_tool_names)
-    planned_tool_names = {step.tool_name for step in plan_result.plan}
-    if not planned_tool_names.issubset(identified_tool_names_set):
-        return StopResponse(reason="Planner hallucinated tools")
-
-    # --- 5. Acknowledgement ---
-    output_config = llm_manager.resolve_llm_config(bot, global_settings, llm_manager.LLM_CATEGORY_OUTPUT_CLIENT)
-    ack_prompt = prompts.ACKNOWLEDGER_SYSTEM_PROMPT.format(bot_personality=bot.personality)
-    ack_messages = [{"role": "user", "content": "Generate an acknowledgement."}]
-    ack_message = await llm_manager.call_llm(output_config, ack_prompt, ack_messages)
-
-    return AcknowledgeAndExecuteResponse(
-        acknowledgement_message=ack_message,
-        final_response_stream_url=f"/api/chat/stream/{request.message_id}",
-        plan=plan_result,
-        tool_definitions=required_tool_definitions
-    )
+        try:
+            # --- 3. Parameter Extraction + Planning (single LLM call) ---
+            required_tool_definitions = [tool for tool in available_tools if tool.get("name") in identified_tool_names_set]
+            if len(required_tool_definitions) == 1 and _takes_no_arguments(required_tool_definitions[0]):
+                # Fast path: a single tool without any argument can only give a one-step plan
+                # with nothing to extract or clarify, so the extraction + planning call is skipped.
+                plan_result = PlannerResult(
+                    plan=[PlanStep(step=1, tool_name=required_tool_definitions[0]["name"], arguments={})]
+                )
+            else:
+                tool_schemas_str = "".join(
+                    f"- Tool: {td['name']}\n  Schema: {_tool_schema_json(td)}\n" for td in required_tool_definitions
+                )
+                allowed_tools_str = ", ".join(required_tool_names)
+
+                extract_and_plan_prompt = prompts.EXTRACT_AND_PLAN_SYSTEM_PROMPT.format(
+                    ace_playbook=playbook_content,
+                    allowed_tools=allowed_tools_str,
+                    tool_schemas=tool_schemas_str,
+                    current_time=current_time_str
+                )
+                response_str = await llm_manager.call_llm(
+                    tools_config, extract_and_plan_prompt, full_history_dicts, json_mode=True, json_schema=_EXTRACT_AND_PLAN_SCHEMA,
+                    coalesce=True
+                )
+
+                cleaned_response = _clean_json_response(response_str)
+                try:
+                    extract_and_plan_result = ExtractAndPlanResult.model_validate_json(cleaned_response)
+                except ValidationError as e:
+                    # Covers malformed JSON too (pydantic reports it as a `json_invalid` error).
+                    # An occasional LLM hiccup, not a bug: no traceback.
+                    logger.warning(f"Parameter extraction parse failed: {e}")
+                    return StopResponse(reason="Parameter extraction error")
+
+                # Filter hallucinations
+                extract_and_plan_result.extracted_parameters = {
+                    k: v for k, v in extract_and_plan_result.extracted_parameters.items() 
+                    if k in identified_tool_names_set
+                }
+                extract_and_plan_result.missing_parameters = [
+                    m for m in extract_and_plan_result.missing_parameters 
+                    if m.tool in identified_tool_names_set
+                ]
+
+                if extract_and_plan_result.missing_parameters:
+                    clarifier_prompt = _clarifier_prompt(bot.name, bot.personality)
+                    technical_question = extract_and_plan_result.clarification_question or "I need more information."
+                    clarifier_messages = [{"role": "user", "content": f"Rephrase this technical question: {technical_question}"}]
+                    user_facing_question = await llm_manager.call_llm(output_config, clarifier_prompt, clarifier_messages)
+                    return ClarifyResponse(message=user_facing_question)
+
+                # --- 4. Planning ---
+                if not extract_and_plan_result.plan:
+                    return StopResponse(reason="Planning error")
+                plan_result = PlannerResult(plan=extract_and_plan_result.plan)
+
+                # --- 4.5 Validation ---
+                planned_tool_names = {step.tool_name for step in plan_result.plan}
+                if not planned_tool_names.issubset(identified_tool_names_set):
+                    return StopResponse(reason="Planner hallucinated tools")
+
+            # --- 5. Acknowledgement (started before step 3, see above) ---
+            ack_message = await ack_task
+
+        finally:
+            if not ack_task.done():
+                ack_task.cancel()
+            elif not ack_task.cancelled():
+                # Mark a failed, unused acknowledgement as retrieved (avoids asyncio's "never retrieved" warning)
+                ack_task.exception()
+
+        return AcknowledgeAndExecuteResponse(
+            acknowledgement_message=ack_message,
+            final_response_stream_url=f"/api/chat/stream/{request.message_id}",
+            plan=plan_result,
+            tool_definitions=required_tool_definitions
+        )
+    finally:
+        # Tool discovery uses the request's Session: neither task may outlive the turn,
+        # whichever way it ends (early return or exception)
+        for task in (tools_task, playbook_task):
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()
 
 # --- Synthesis Phase Router ---
 
@@ -326,84 +558,242 @@ async def run_synthesis_phase(
     bot: sql_models.Bot,
     global_settings: sql_models.GlobalSettings,
     history: List[Dict[str, Any]],
-    tool_results: List[Dict[str, Any]]
+    tool_results: List[Dict[str, Any]],
+    playbook_content: Optional[str] = None
 ) -> AsyncGenerator[str, None]:
-    
-    playbook_content = _load_bot_playbook_content(bot.id)
+    """
+    Prepares the synthesis context and returns the synthesizer's stream.
+    The synthesizer generator is handed back as-is (not re-yielded) so each
+    streamed chunk crosses one generator frame less. Usage:
+    `async for chunk in await run_synthesis_phase(...)`.
+    Callers that already loaded the playbook (e.g. while tools were running)
+    pass it in through `playbook_content`.
+    """
+    if playbook_content is None:
+        playbook_content = await load_bot_playbook(bot.id)
     # Get current time for the synthesizer prompt
     current_time_str = _get_current_time_str()
 
-    if tool_results:
-        async for chunk in synthesizer.run_tool_result_synthesizer(
-            bot=bot,
-            global_settings=global_settings,
-            history=history,
-            tool_results=tool_results,
-            playbook_content=playbook_content,
-            current_time=current_time_str # Pass time to synthesizer
-        ):
-            yield chunk
-    else:
-        async for chunk in synthesizer.run_synthesizer(
-            bot=bot,
-            global_settings=global_settings,
-            history=history,
-            tool_results=tool_results,
-            playbook_content=playbook_content,
-            current_time=current_time_str # Pass time to synthesizer
-        ):
-            yield chunk
+    synthesizer_fn = synthesizer.run_tool_result_synthesizer if tool_results else synthesizer.run_synthesizer
+    return synthesizer_fn(
+        bot=bot,
+        global_settings=global_settings,
+        history=history,
+        tool_results=tool_results,
+        playbook_content=playbook_content,
+        current_time=current_time_str # Pass time to synthesizer
+    )
 
 # --- Tool Discovery & Execution (Modified for MCPHub Compatibility) ---
 
+def invalidate_bot_tools(bot_id: Optional[int] = None) -> None:
+    """
+    Drops the cached tool list of a bot, or of every bot when bot_id is None
+    (e.g. after an MCP server used by several bots was edited or deleted).
+    """
+    if bot_id is None:
+        _TOOLS_CACHE.clear()
+    else:
+        _TOOLS_CACHE.pop(bot_id, None)
+
+
+async def _discover_server_tools(server: Any, max_retries: int = 3) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Lists the tools of one MCP server, with retries and circuit breaking.
+    Returns (tool definitions, whether the discovery completed).
+    """
+    if not _breaker_allow_request(server.id):
+        logger.warning(f"Circuit open for MCP server {server.name}, skipping tool discovery.")
+        return [], False
+
+    for attempt in range(max_retries):
+        session = None
+        try:
+            # FIX 3: Timeout to prevent blocking
+            session = await mcp_pool.get_session(server, timeout=10.0)
+            if session:
+                tools = await session.list_tools()
+                _breaker_record_success(server.id)
+                for tool in tools:
+                    _TOOL_SCHEMA_JSON[(server.id, tool.name)] = json.dumps(tool.inputSchema or {})
+                return [
+                    {
+                        "name": tool.name,
+                        "description": tool.description or "",
+                        "inputSchema": tool.inputSchema or {},
+                        "server_id": server.id
+                    }
+                    for tool in tools
+                ], True
+        except asyncio.TimeoutError:
+            logger.warning(f"Timeout discovering tools on {server.name}. Skipping.")
+            _breaker_record_failure(server.id)
+            return [], False
+        except Exception as e:
+            if session is not None:
+                await mcp_pool.invalidate(server.id, session)
+            if attempt == max_retries - 1:
+                logger.error(f"Discovery failed for server {server.name}: {e}")
+                _breaker_record_failure(server.id)
+                return [], False
+            await asyncio.sleep(0.5)
+    return [], False
+
+
 async def get_available_tools_for_bot(db: Session, bot_id: int) -> List[Dict[str, Any]]:
+    cached = _TOOLS_CACHE.get(bot_id)
+    if cached and time.monotonic() - cached[0] < TOOLS_CACHE_TTL_S:
+        return cached[1]
+
     mcp_servers = crud_mcp.get_mcp_servers_for_bot(db, bot_id=bot_id)
     if not mcp_servers:
         return []
 
+    # Servers are queried concurrently: discovery costs the slowest server, not the sum.
+    # _discover_server_tools never raises, so one failing server can't cancel the others.
+    async with asyncio.TaskGroup() as tg:
+        tasks = [tg.create_task(_discover_server_tools(server)) for server in mcp_servers]
+
     all_tools = []
-    for server in mcp_servers:
-        # FIX 1: Strip trailing slash
-        base_url = f"http://{server.host}:{server.port}{server.rpc_endpoint_path}".rstrip('/')
-        server_key = f"server_{server.id}"
-        
-        # FIX 2: Explicitly disable OAuth to prevent mcp-use from trying OIDC discovery on MCPHub
-        single_server_config = {
-            "mcpServers": {
-                server_key: {
-                    "transport": "sse", 
-                    "url": base_url,
-                    "oauth": False
-                }
-            }
-        }
-        
-        max_retries = 3
-        for attempt in range(max_retries):
+    # Only a complete discovery is cached, so an unreachable server is retried next turn
+    discovery_complete = True
+    for task in tasks:
+        server_tools, completed = task.result()
+        all_tools.extend(server_tools)
+        discovery_complete = discovery_complete and completed
+
+    if discovery_complete:
+        _TOOLS_CACHE[bot_id] = (time.monotonic(), all_tools)
+    return all_tools
+
+
+async def _run_single_step(
+    step: Any, tool_map: Dict[str, Dict[str, Any]], servers: Dict[int, Any], max_retries: int = 3
+) -> Optional[Dict[str, Any]]:
+    """
+    Executes one plan step on its MCP server, with retries and circuit breaking.
+    Returns the step's result entry, or None if the tool is unknown.
+    """
+    tool_name = step.tool_name
+    tool_def = tool_map.get(tool_name)
+    if not tool_def:
+        return None
+
+    server_id = tool_def.get('server_id')
+    server = servers.get(server_id)
+    if server is None:
+        return {"tool_name": tool_name, "result": {"error": "MCP server is not associated with this bot"}}
+
+    if not _breaker_allow_request(server_id):
+        logger.warning(f"Circuit open for MCP server {server_id}, skipping tool '{tool_name}'.")
+        return {"tool_name": tool_name, "result": {"error": "server unavailable"}}
+    
+    last_error = None
+    
+    for attempt in range(max_retries):
+        session = None
+        try:
+            # FIX 3: Timeout
+            session = await mcp_pool.get_session(server, timeout=15.0)
+            if not session:
+                 raise Exception("Could not retrieve session")
+
+            call_started = time.monotonic()
+            call_timeout = _tool_call_timeout(server_id, tool_name)
             try:
-                client = MCPClient(single_server_config)
-                # FIX 3: Timeout to prevent blocking
-                await asyncio.wait_for(client.create_all_sessions(), timeout=10.0)
-                
-                session = client.get_session(server_key)
-                if session:
-                    tools = await session.list_tools()
-                    for tool in tools:
-                        all_tools.append({
-                            "name": tool.name,
-                            "description": tool.description or "",
-                            "inputSchema": tool.inputSchema or {},
-                            "server_id": server.id 
-                        })
-                    break
+                result_obj = await asyncio.wait_for(session.call_tool(tool_name, step.arguments), timeout=call_timeout)
             except asyncio.TimeoutError:
-                logger.warning(f"Timeout discovering tools on {server.name}. Skipping.")
+                # A slow tool is not a dead connection. No retry (the call may not be idempotent
+                # and may still run on the server), no breaker failure, and the shared session stays pooled.
+                logger.warning(f"Tool '{tool_name}' on MCP server {server_id} timed out after {call_timeout:.0f}s.")
+                return {"tool_name": tool_name, "result": {"error": f"Tool call timed out after {call_timeout:.0f}s"}}
+            _record_tool_latency(server_id, tool_name, time.monotonic() - call_started)
+            
+            # MCP content items are pydantic models with a stable schema: dispatch on `type`
+            content = getattr(result_obj, 'content', None)
+            if isinstance(content, list):
+                content_list = []
+                for item in content:
+                    item_type = getattr(item, 'type', None)
+                    if item_type == 'text':
+                        content_list.append(item.text)
+                    elif item_type == 'image':
+                        content_list.append(f"[Image Data: {item.mimeType}]")
+                    else:
+                        content_list.append(str(item))
+                final_output = {"text_content": "\n".join(content_list)}
+            else:
+                final_output = {"result": str(result_obj)}
+
+            if getattr(result_obj, "isError", False):
+                 final_output["is_error"] = True
+
+            _breaker_record_success(server_id)
+            return {"tool_name": tool_name, "result": final_output}
+
+        # TransportError covers connect failures (server down), read timeouts and protocol errors;
+        # ConnectionError covers a refused/reset socket surfacing outside httpx
+        except (httpx.TransportError, ConnectionError, asyncio.TimeoutError) as net_err:
+            last_error = net_err
+            _breaker_record_failure(server_id)
+            # The pooled session may be dead: drop it (unless another call already
+            # replaced it, or it is still connected) so the next attempt reconnects
+            if session is not None:
+                await mcp_pool.invalidate(server_id, session)
+            if _breaker_is_open(server_id):
+                # Don't spend more retries on a dead server
                 break
-            except Exception as e:
-                if attempt == max_retries - 1:
-                    logger.error(f"Discovery failed for server {server.name}: {e}")
-                await asyncio.sleep(0.5)
-    return all_tools
+            await asyncio.sleep(0.5)
+        except Exception as e:
+            last_error = e
+            break
+    
+    return {"tool_name": tool_name, "result": {"error": str(last_error)}}
+
+
+def _tool_result_cache_key(server_id: int, tool_name: str, arguments: Dict[str, Any], tool_config: Dict[str, Any]) -> str:
+    payload = json.dumps([server_id, tool_name, arguments, tool_config], sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _store_tool_result(key: str, ttl: float, result: Dict[str, Any]) -> None:
+    now = time.monotonic()
+    if len(_TOOL_RESULT_CACHE) >= TOOL_RESULT_CACHE_MAX_ENTRIES:
+        # Drop expired entries first, then the oldest ones if still full
+        for stale_key in [k for k, (expiry, _) in _TOOL_RESULT_CACHE.items() if expiry <= now]:
+            del _TOOL_RESULT_CACHE[stale_key]
+        while len(_TOOL_RESULT_CACHE) >= TOOL_RESULT_CACHE_MAX_ENTRIES:
+            del _TOOL_RESULT_CACHE[next(iter(_TOOL_RESULT_CACHE))]
+    _TOOL_RESULT_CACHE[key] = (now + ttl, result)
+
+
+async def _run_single_step_cached(
+    step: Any, tool_map: Dict[str, Dict[str, Any]], servers: Dict[int, Any], server_configs: Dict[int, Dict[str, Any]]
+) -> Optional[Dict[str, Any]]:
+    """
+    Runs a plan step through the tool result cache when the bot opted in for that tool.
+    """
+    tool_def = tool_map.get(step.tool_name)
+    server_id = tool_def.get('server_id') if tool_def else None
+    server_config = server_configs.get(server_id) or {}
+    try:
+        ttl = float((server_config.get("tool_cache") or {}).get(step.tool_name) or 0)
+    except (TypeError, ValueError):
+        ttl = 0.0
+    if ttl <= 0:
+        return await _run_single_step(step, tool_map, servers)
+
+    key = _tool_result_cache_key(server_id, step.tool_name, step.arguments, server_config)
+    cached = _TOOL_RESULT_CACHE.get(key)
+    if cached and cached[0] > time.monotonic():
+        logger.info(f"Tool result cache hit for '{step.tool_name}'.")
+        return cached[1]
+
+    res = await _run_single_step(step, tool_map, servers)
+    result = res.get("result", {}) if res else {}
+    if res and "error" not in result and not result.get("is_error"):
+        _store_tool_result(key, ttl, res)
+    return res
 
 
 async def execute_tool_plan(
@@ -419,91 +809,34 @@ async def execute_tool_plan(
         if tool_def and 'server_id' in tool_def:
             involved_server_ids.add(tool_def['server_id'])
     
-    mcp_config = {"mcpServers": {}}
+    servers = {}
+    server_configs = {}
     for server_id in involved_server_ids:
         association = crud_mcp.get_association(db, bot_id=bot_id, mcp_server_id=server_id)
         if association and association.mcp_server:
-            server = association.mcp_server
-            # FIX 1: Strip trailing slash
-            base_url = f"http://{server.host}:{server.port}{server.rpc_endpoint_path}".rstrip('/')
-            
-            # FIX 2: Explicitly disable OAuth
-            mcp_config["mcpServers"][f"server_{server.id}"] = {
-                "transport": "sse", 
-                "url": base_url, 
-                "oauth": False
-            }
-
-    if not mcp_config["mcpServers"]:
+            servers[server_id] = association.mcp_server
+            server_configs[server_id] = association.configuration or {}
+
+    if not servers:
         return []
 
-    max_retries = 3
-    client = None
     try:
-        client = MCPClient(mcp_config)
-        # FIX 3: Timeout
-        await asyncio.wait_for(client.create_all_sessions(), timeout=15.0)
-        
-        for step in sorted(plan_result.plan, key=lambda x: x.step):
-            tool_name = step.tool_name
-            tool_def = tool_map.get(tool_name)
-            if not tool_def:
-                continue
-
-            server_id = tool_def.get('server_id')
-            server_key = f"server_{server_id}"
-            
-            tool_success = False
-            last_error = None
-            
-            for attempt in range(max_retries):
-                try:
-                    session = client.get_session(server_key)
-                    if not session:
-                        # Attempt to recreate sessions if lost
-                        await asyncio.wait_for(client.create_all_sessions(), timeout=5.0)
-                        session = client.get_session(server_key)
-                    
-                    if not session:
-                         raise Exception("Could not retrieve session")
-
-                    result_obj = await session.call_tool(tool_name, step.arguments)
-                    
-                    final_output = {}
-                    content_list = []
-                    if hasattr(result_obj, 'content') and isinstance(result_obj.content, list):
-                        for item in result_obj.content:
-                            if hasattr(item, 'type') and hasattr(item, 'text') and item.type == 'text':
-                                content_list.append(item.text)
-                            else:
-                                content_list.append(str(item))
-                        final_output = {"text_content": "\n".join(content_list)}
-                    else:
-                        final_output = {"result": str(result_obj)}
-
-                    if getattr(result_obj, "isError", False):
-                         final_output["is_error"] = True
-
-                    tool_execution_results.append({"tool_name": tool_name, "result": final_output})
-                    tool_success = True
-                    break
-
-                except (httpx.RemoteProtocolError, httpx.ReadTimeout) as net_err:
-                    last_error = net_err
-                    try:
-                        # Re-instantiate client on network error
-                        client = MCPClient(mcp_config)
-                        await asyncio.wait_for(client.create_all_sessions(), timeout=5.0)
-                    except: pass
-                    await asyncio.sleep(0.5)
-                except Exception as e:
-                    last_error = e
-                    break
-            
-            if not tool_success:
-                 tool_execution_results.append({"tool_name": tool_name, "result": {"error": str(last_error)}})
+        for wave in _group_plan_into_waves(plan_result, parallel=settings.PARALLEL_TOOL_EXECUTION):
+            if len(wave) > 1:
+                logger.info(f"Executing {len(wave)} independent plan steps concurrently.")
+            wave_results = await asyncio.gather(
+                *(_run_single_step_cached(step, tool_map, servers, server_configs) for step in wave),
+                return_exceptions=True
+            )
+            for step, res in zip(wave, wave_results):
+                if isinstance(res, BaseException):
+                    # One failing step must not discard the results of its siblings
+                    logger.error(f"Unexpected error while running tool '{step.tool_name}': {res}")
+                    res = {"tool_name": step.tool_name, "result": {"error": str(res)}}
+                if res is not None:
+                    tool_execution_results.append(res)
 
     except Exception as e:
          logger.error(f"Fatal error in MCP execution: {e}")
     
-    return tool_execution_results
\ No newline at end of file
+    return tool_execution_results
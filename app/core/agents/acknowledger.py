@@ -3,7 +3,7 @@ from typing import List
 
 from app.core.agents.prompts import ACKNOWLEDGER_SYSTEM_PROMPT
 from app.core.llm.ollama_client import get_llm_response
-from app.schemas.chat_schemas import ChatMessage, PlannerResult
+from app.schemas.chat_schemas import ChatMessage, PlannerResult, dump_chat_history
 
 logger = logging.getLogger(__name__)
 
@@ -59,7 +59,7 @@ async def run_acknowledger(
     prompt = prompt.replace("{{bot_personality}}", bot_personality)
     prompt = prompt.replace("{{execution_plan_summary}}", plan_summary)
 
-    messages = [msg.model_dump() for msg in history]
+    messages = dump_chat_history(history)
 
     try:
         # 2. Call the LLM for a simple text response.
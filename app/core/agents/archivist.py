@@ -1,12 +1,13 @@
 # app/core/agents/archivist.py
-import json
 import logging
 from typing import List
 
+from pydantic import ValidationError
+
 # MODIFIED: Import the new LLM manager and necessary DB models
 from app.core import llm_manager
 from app.database.sql_models import Bot, GlobalSettings
-from app.schemas.chat_schemas import ChatMessage, ArchivistDecision
+from app.schemas.chat_schemas import ChatMessage, ArchivistDecision, dump_chat_history
 
 logger = logging.getLogger(__name__)
 
@@ -22,7 +23,7 @@ async def run_archivist(
     """
     logger.debug("Running Archivist to analyze conversation for memory...")
 
-    messages = [msg.model_dump() for msg in full_conversation]
+    messages = dump_chat_history(full_conversation)
 
     try:
         # 1. Resolve the specific LLM config. 'Tools' is a good fit for structured data extraction.
@@ -31,7 +32,7 @@ async def run_archivist(
         )
         
         # 2. Call the LLM using the manager. The prompt is already in the manager's scope.
-        logger.info(f"Archivist calling LLM with config: {tools_config.model_dump()}")
+        logger.info("Archivist calling LLM with config: %r", tools_config)
         llm_response_str = await llm_manager.call_llm(
             config=tools_config,
             system_prompt=llm_manager.prompts.ARCHIVIST_SYSTEM_PROMPT,
@@ -39,9 +40,8 @@ async def run_archivist(
             json_mode=True
         )
 
-        # 3. Parse and validate the response.
-        decision_data = json.loads(llm_response_str)
-        decision = ArchivistDecision.model_validate(decision_data)
+        # 3. Parse and validate the response in a single pass.
+        decision = ArchivistDecision.model_validate_json(llm_response_str)
 
         if decision.notes_to_create:
             note_count = len(decision.notes_to_create)
@@ -51,8 +51,8 @@ async def run_archivist(
 
         return decision
 
-    except json.JSONDecodeError:
-        logger.error("Archivist failed to parse LLM response as JSON.")
+    except ValidationError as e:
+        logger.error(f"Archivist failed to parse LLM response as a valid decision: {e}")
         return ArchivistDecision()
     except Exception as e:
         logger.error(f"An unexpected error occurred in Archivist: {e}", exc_info=True)
@@ -3,7 +3,7 @@ from typing import Dict, Any, List
 
 from app.core.agents.prompts import CLARIFIER_SYSTEM_PROMPT
 from app.core.llm.ollama_client import get_llm_response
-from app.schemas.chat_schemas import ChatMessage
+from app.schemas.chat_schemas import ChatMessage, dump_chat_history
 
 logger = logging.getLogger(__name__)
 
@@ -36,7 +36,7 @@ async def run_clarifier(
     prompt = prompt.replace("{{bot_personality}}", bot_personality)
     prompt = prompt.replace("{{clarification_question}}", technical_question)
 
-    messages = [msg.model_dump() for msg in history]
+    messages = dump_chat_history(history)
 
     try:
         # 2. Call the LLM. We expect a simple text response here, not JSON.
@@ -1,10 +1,11 @@
-import json
 import logging
 from typing import List
 
+from pydantic import ValidationError
+
 from app.core.agents.prompts import GATEKEEPER_SYSTEM_PROMPT
 from app.core.llm.ollama_client import get_llm_json_response
-from app.schemas.chat_schemas import ChatMessage, GatekeeperDecision
+from app.schemas.chat_schemas import ChatMessage, GatekeeperDecision, dump_chat_history
 
 logger = logging.getLogger(__name__)
 
@@ -34,7 +35,7 @@ async def run_gatekeeper(
     formatted_prompt = GATEKEEPER_SYSTEM_PROMPT.replace("{{bot_name}}", bot_name)
 
     # 2. Convert Pydantic models to dictionaries for the LLM client.
-    messages = [msg.model_dump() for msg in history]
+    messages = dump_chat_history(history)
 
     try:
         # 3. Call the LLM with the specific prompt and messages.
@@ -44,17 +45,14 @@ async def run_gatekeeper(
             messages=messages
         )
 
-        # 4. Parse the LLM's string response into a Python dictionary.
-        decision_data = json.loads(llm_response_str)
-
-        # 5. Validate the dictionary against our Pydantic schema.
-        # This ensures the LLM's output has the correct structure and types.
-        decision = GatekeeperDecision.model_validate(decision_data)
+        # 4. Parse and validate the LLM's string response against our Pydantic schema
+        # in a single pass. This ensures the output has the correct structure and types.
+        decision = GatekeeperDecision.model_validate_json(llm_response_str)
         logger.info(f"Gatekeeper decision: {decision.should_respond}. Reason: {decision.reason}")
         return decision
 
-    except json.JSONDecodeError:
-        logger.error("Gatekeeper failed to parse LLM response as JSON.")
+    except ValidationError as e:
+        logger.error(f"Gatekeeper failed to parse LLM response as a valid decision: {e}")
         # Fallback to a safe default if the LLM response is not valid JSON.
         return GatekeeperDecision(reason="LLM response was not valid JSON.", should_respond=False)
     except Exception as e:
@@ -1,11 +1,12 @@
 # /app/app/core/agents/parameter_extractor.py
-import json
 import logging
 from typing import List, Dict, Any
 
+from pydantic import ValidationError
+
 from app.core.agents.prompts import PARAMETER_EXTRACTOR_SYSTEM_PROMPT
 from app.core.llm.ollama_client import get_llm_json_response
-from app.schemas.chat_schemas import ChatMessage, ParameterExtractorResult
+from app.schemas.chat_schemas import ChatMessage, ParameterExtractorResult, dump_chat_history
 
 logger = logging.getLogger(__name__)
 
@@ -73,7 +74,7 @@ async def run_parameter_extractor(
     # 2. Combine the base prompt with the dynamic tool schema section.
     system_prompt = PARAMETER_EXTRACTOR_SYSTEM_PROMPT + "\n\n" + tools_schema_prompt_section
 
-    messages = [msg.model_dump() for msg in history]
+    messages = dump_chat_history(history)
 
     try:
         # 3. Call the LLM.
@@ -83,12 +84,11 @@ async def run_parameter_extractor(
         )
 
         # === AJOUT DU LOGGING DÉTAILLÉ ===
-        logger.info(f"Raw JSON response from Parameter Extractor LLM: {llm_response_str}")
+        logger.info("Raw JSON response from Parameter Extractor LLM: %s", llm_response_str)
         # ==================================
 
-        # 4. Parse and validate the response.
-        result_data = json.loads(llm_response_str)
-        result = ParameterExtractorResult.model_validate(result_data)
+        # 4. Parse and validate the response in a single pass.
+        result = ParameterExtractorResult.model_validate_json(llm_response_str)
 
         if result.missing_parameters:
             logger.info(f"Parameter Extractor found missing parameters and generated clarification: {result.clarification_question}")
@@ -97,8 +97,8 @@ async def run_parameter_extractor(
 
         return result
 
-    except json.JSONDecodeError:
-        logger.error("Parameter Extractor failed to parse LLM response as JSON.")
+    except ValidationError as e:
+        logger.error(f"Parameter Extractor failed to parse LLM response as a valid result: {e}")
         return ParameterExtractorResult() # Safe default
     except Exception as e:
         logger.error(f"An unexpected error occurred in Parameter Extractor: {e}", exc_info=True)
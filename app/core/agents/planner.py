@@ -1,11 +1,13 @@
 # /app/app/core/agents/planner.py
-import json
 import logging
+from datetime import datetime, timezone
 from typing import List, Dict, Any
 
+from pydantic import ValidationError
+
 from app.core.agents.prompts import PLANNER_SYSTEM_PROMPT
 from app.core.llm.ollama_client import get_llm_json_response
-from app.schemas.chat_schemas import ChatMessage, PlannerResult, ParameterExtractorResult
+from app.schemas.chat_schemas import ChatMessage, PlannerResult, ParameterExtractorResult, dump_chat_history
 
 logger = logging.getLogger(__name__)
 
@@ -67,10 +69,14 @@ async def run_planner(
 
     # 2. Combine the base prompt with the dynamic section.
     # INJECTION OF ACE PLAYBOOK
-    base_prompt = PLANNER_SYSTEM_PROMPT.format(ace_playbook=playbook_content)
+    base_prompt = PLANNER_SYSTEM_PROMPT.format(
+        ace_playbook=playbook_content,
+        allowed_tools=", ".join(validated_parameters.extracted_parameters),
+        current_time=datetime.now(timezone.utc).strftime("%A, %B %d, %Y, %H:%M UTC")
+    )
     system_prompt = base_prompt + "\n\n" + available_blocks_prompt
 
-    messages = [msg.model_dump() for msg in history]
+    messages = dump_chat_history(history)
 
     try:
         # 3. Call the LLM.
@@ -79,20 +85,19 @@ async def run_planner(
             messages=messages
         )
 
-        # 4. Parse and validate the response against our Pydantic schema.
-        result_data = json.loads(llm_response_str)
-        plan = PlannerResult.model_validate(result_data)
+        # 4. Parse and validate the response against our Pydantic schema in a single pass.
+        plan = PlannerResult.model_validate_json(llm_response_str)
 
         if plan.plan:
-            logger.info(f"Planner created a plan with {len(plan.plan)} step(s).")
+            logger.info("Planner created a plan with %d step(s).", len(plan.plan))
         else:
             logger.warning("Planner generated an empty plan.")
         
         return plan
 
-    except json.JSONDecodeError:
-        logger.error("Planner failed to parse LLM response as JSON.")
+    except (ValidationError, ValueError) as e:
+        logger.error(f"Planner failed to parse LLM response as a valid plan: {e}")
         return PlannerResult() # Safe default
     except Exception as e:
-        logger.error(f"An unexpected error occurred in Planner: {e}", exc_info=True)
+        logger.error("An unexpected error occurred in Planner: %s", e, exc_info=True)
         return PlannerResult() # Safe default
\ No newline at end of file
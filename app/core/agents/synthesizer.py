@@ -1,14 +1,76 @@
 # app/core/agents/synthesizer.py
-import json
+import contextlib
 import logging
 from typing import List, Dict, Any, AsyncGenerator
 
-from app.core import llm_manager
+from app.core.agents.prompts import render_synthesizer_prompt, render_tool_result_synthesizer_prompt
+from app.core.llm_manager import LLM_CATEGORY_OUTPUT_CLIENT, call_llm_stream, resolve_llm_config
 from app.database.sql_models import Bot, GlobalSettings
 from app.schemas.chat_schemas import ChatMessage
 
 logger = logging.getLogger(__name__)
 
+_RESULTS_HEADER = "Here are the results from the tools that were executed:\n\n"
+_TOOL_LINE = "--- Tool: `{name}` ---\nResult: {out}\n\n".format
+_TOOL_ERROR_LINE = "--- Tool: `{name}` ---\nResult: The tool execution failed with an error: {error}\n\n".format
+
+def _format_one(res: Dict[str, Any]) -> str:
+    """Formats a single tool execution result as a prompt segment."""
+    tool_name = res.get("tool_name", "unknown_tool")
+    result_data = res.get("result", {})
+
+    # Non-dict results can only be dumped as-is
+    if not isinstance(result_data, dict):
+        return _TOOL_LINE(name=tool_name, out=str(result_data))
+
+    # 1. Handle explicit errors
+    if "error" in result_data:
+        error_message = result_data["error"]
+        if isinstance(error_message, dict):
+            error_message = error_message.get("message", "Unknown error")
+        return _TOOL_ERROR_LINE(name=tool_name, error=error_message)
+
+    # 2. Check for the standardized 'text_content' (New Orchestrator Format)
+    if "text_content" in result_data:
+        return _TOOL_LINE(name=tool_name, out=result_data["text_content"])
+
+    # 3. Fallback: Check for 'content' list (Legacy/Raw MCP Format)
+    # 4. Last Resort: Dump the whole result
+    if "content" not in result_data:
+        return _TOOL_LINE(name=tool_name, out=str(result_data))
+
+    formatted_outputs = []
+    add_output = formatted_outputs.append
+
+    for item in result_data["content"]:
+        # Handle dicts or objects
+        item_is_dict = isinstance(item, dict)
+        item_type = item.get("type") if item_is_dict else getattr(item, "type", None)
+        
+        if item_type == "text":
+            add_output(item.get("text", "") if item_is_dict else getattr(item, "text", ""))
+        elif item_type == "image":
+            # Handle image source/url
+            if item_is_dict:
+                source_url = item.get("source") or item.get("url") # Try common keys
+                mime_type = item.get("mimeType")
+            else:
+                source_url = getattr(item, "source", None) or getattr(item, "url", None)
+                mime_type = getattr(item, "mimeType", None)
+
+            if source_url:
+                add_output(f"An image was generated and is available at the following URL: {source_url}")
+            elif mime_type:
+                add_output(f"[Image Data: {mime_type}]")
+
+    if formatted_outputs:
+        tool_output = " ".join(formatted_outputs)
+    else:
+        # If content list exists but is empty or unparsable
+        tool_output = "The tool executed but returned no displayable content."
+
+    return _TOOL_LINE(name=tool_name, out=tool_output)
+
 
 def _format_tool_results_for_prompt(tool_results: List[Dict[str, Any]]) -> str:
     """
@@ -18,64 +80,7 @@ def _format_tool_results_for_prompt(tool_results: List[Dict[str, Any]]) -> str:
     if not tool_results:
         return "No tools were executed."
 
-    prompt = "Here are the results from the tools that were executed:\n\n"
-    for res in tool_results:
-        tool_name = res.get("tool_name", "unknown_tool")
-        result_data = res.get("result", {})
-        
-        # 1. Handle explicit errors
-        if isinstance(result_data, dict) and "error" in result_data:
-            error_message = result_data["error"]
-            if isinstance(error_message, dict):
-                error_message = error_message.get("message", "Unknown error")
-            prompt += f"--- Tool: `{tool_name}` ---\nResult: The tool execution failed with an error: {error_message}\n\n"
-            continue
-
-        tool_output = ""
-
-        # 2. Check for the standardized 'text_content' (New Orchestrator Format)
-        if isinstance(result_data, dict) and "text_content" in result_data:
-            tool_output = result_data["text_content"]
-        
-        # 3. Fallback: Check for 'content' list (Legacy/Raw MCP Format)
-        elif isinstance(result_data, dict) and "content" in result_data:
-            content_list = result_data.get("content", [])
-            formatted_outputs = []
-            
-            for item in content_list:
-                # Handle dicts or objects
-                item_type = item.get("type") if isinstance(item, dict) else getattr(item, "type", None)
-                
-                if item_type == "text":
-                    text_val = item.get("text", "") if isinstance(item, dict) else getattr(item, "text", "")
-                    formatted_outputs.append(text_val)
-                elif item_type == "image":
-                    # Handle image source/url
-                    if isinstance(item, dict):
-                            source_url = item.get("source") or item.get("url") # Try common keys
-                            mime_type = item.get("mimeType")
-                    else:
-                            source_url = getattr(item, "source", None) or getattr(item, "url", None)
-                            mime_type = getattr(item, "mimeType", None)
-
-                    if source_url:
-                        formatted_outputs.append(f"An image was generated and is available at the following URL: {source_url}")
-                    elif mime_type:
-                        formatted_outputs.append(f"[Image Data: {mime_type}]")
-
-            if formatted_outputs:
-                tool_output = " ".join(formatted_outputs)
-            else:
-                    # If content list exists but is empty or unparsable
-                    tool_output = "The tool executed but returned no displayable content."
-
-        # 4. Last Resort: Dump the whole result
-        else:
-            tool_output = str(result_data)
-
-        prompt += f"--- Tool: `{tool_name}` ---\nResult: {tool_output}\n\n"
-    
-    return prompt
+    return _RESULTS_HEADER + "".join([_format_one(res) for res in tool_results])
 
 async def run_synthesizer(
     bot: Bot,
@@ -91,29 +96,27 @@ async def run_synthesizer(
     logger.debug("Running conversational Synthesizer to generate response...")
 
     try:
-        output_config = llm_manager.resolve_llm_config(
-            bot, global_settings, llm_manager.LLM_CATEGORY_OUTPUT_CLIENT
+        output_config = resolve_llm_config(
+            bot, global_settings, LLM_CATEGORY_OUTPUT_CLIENT
         )
 
-        # Updated format call with current_time
-        system_prompt = llm_manager.prompts.SYNTHESIZER_SYSTEM_PROMPT.format(
-            bot_name=bot.name,
-            bot_personality=bot.personality,
-            ace_playbook=playbook_content,
-            current_time=current_time
+        system_prompt = render_synthesizer_prompt(
+            bot.name, bot.personality, playbook_content, current_time
         )
 
-        logger.info(f"Conversational Synthesizer calling LLM with config: {output_config.model_dump()}")
+        logger.info("Conversational Synthesizer calling LLM with config: %r", output_config)
 
-        async for chunk in llm_manager.call_llm_stream(
+        stream = call_llm_stream(
             config=output_config,
             system_prompt=system_prompt,
             messages=list(history)
-        ):
-            yield chunk
+        )
+        async with contextlib.aclosing(stream):
+            async for chunk in stream:
+                yield chunk
 
     except Exception as e:
-        logger.error(f"An unexpected error in conversational Synthesizer: {e}", exc_info=True)
+        logger.error("An unexpected error in conversational Synthesizer: %s", e, exc_info=True)
         yield "I'm sorry, I encountered an error while trying to formulate my response."
 
 
@@ -131,36 +134,30 @@ async def run_tool_result_synthesizer(
     logger.debug("Running Tool Result Synthesizer to report tool outputs...")
 
     try:
-        output_config = llm_manager.resolve_llm_config(
-            bot, global_settings, llm_manager.LLM_CATEGORY_OUTPUT_CLIENT
+        output_config = resolve_llm_config(
+            bot, global_settings, LLM_CATEGORY_OUTPUT_CLIENT
         )
 
         # Format the results using the improved function
         tool_results_prompt_section = _format_tool_results_for_prompt(tool_results)
         
-        # Updated format call with current_time
-        system_prompt = llm_manager.prompts.TOOL_RESULT_SYNTHESIZER_SYSTEM_PROMPT.format(
-            bot_name=bot.name,
-            bot_personality=bot.personality,
-            ace_playbook=playbook_content,
-            current_time=current_time
+        system_prompt = render_tool_result_synthesizer_prompt(
+            bot.name, bot.personality, playbook_content, current_time
         )
 
-        final_prompt_messages = list(history)
-        final_prompt_messages.append({
-            "role": "system",
-            "content": tool_results_prompt_section
-        })
+        final_prompt_messages = [*history, {"role": "system", "content": tool_results_prompt_section}]
 
-        logger.info(f"Tool Result Synthesizer calling LLM with config: {output_config.model_dump()}")
+        logger.info("Tool Result Synthesizer calling LLM with config: %r", output_config)
 
-        async for chunk in llm_manager.call_llm_stream(
+        stream = call_llm_stream(
             config=output_config,
             system_prompt=system_prompt,
             messages=final_prompt_messages
-        ):
-            yield chunk
+        )
+        async with contextlib.aclosing(stream):
+            async for chunk in stream:
+                yield chunk
 
     except Exception as e:
-        logger.error(f"An unexpected error in Tool Result Synthesizer: {e}", exc_info=True)
+        logger.error("An unexpected error in Tool Result Synthesizer: %s", e, exc_info=True)
         yield "I'm sorry, I encountered an error while trying to report the results."
\ No newline at end of file
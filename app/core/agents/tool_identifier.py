@@ -1,11 +1,12 @@
 #### app/core/agents/tool_identifier.py
-import json
 import logging
 from typing import List, Dict, Any
 
+from pydantic import ValidationError
+
 from app.core.agents.prompts import TOOL_IDENTIFIER_SYSTEM_PROMPT
 from app.core.llm.ollama_client import get_llm_json_response
-from app.schemas.chat_schemas import ChatMessage, ToolIdentifierResult
+from app.schemas.chat_schemas import ChatMessage, ToolIdentifierResult, dump_chat_history
 
 logger = logging.getLogger(__name__)
 
@@ -60,9 +61,9 @@ async def run_tool_identifier(
     )
     
     # --- MODIFICATION: Passage du log en INFO pour garantir sa visibilité ---
-    logger.info(f"Final system prompt for Tool Identifier:\n{system_prompt}")
+    logger.info("Final system prompt for Tool Identifier:\n%s", system_prompt)
 
-    messages = [msg.model_dump() for msg in history]
+    messages = dump_chat_history(history)
 
     try:
         # 3. Call the LLM with the combined prompt and conversation history.
@@ -71,11 +72,9 @@ async def run_tool_identifier(
             messages=messages
         )
 
-        # 4. Parse the LLM's JSON response.
-        result_data = json.loads(llm_response_str)
-
-        # 5. Validate the data against our Pydantic schema.
-        result = ToolIdentifierResult.model_validate(result_data)
+        # 4. Parse and validate the LLM's JSON response against our Pydantic schema
+        # in a single pass (no intermediate dict).
+        result = ToolIdentifierResult.model_validate_json(llm_response_str)
 
         if result.required_tools:
             logger.info(f"Tool Identifier identified required tools: {result.required_tools}")
@@ -84,7 +83,7 @@ async def run_tool_identifier(
 
         return result
 
-    except json.JSONDecodeError:
+    except ValidationError:
         logger.error("Tool Identifier failed to parse LLM response as JSON.")
         return ToolIdentifierResult()  # Return default empty list
     except Exception as e:
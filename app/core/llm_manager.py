@@ -1,17 +1,26 @@
 # app/core/llm_manager.py
 
+import asyncio
+import atexit
+import contextlib
+import functools
+import hashlib
+import importlib.util
+import json
 import logging
 import os
+import queue
+import random
 import threading
+import time
 import warnings
-import sys # ADDED: For forced stdout printing
-from datetime import datetime
-from typing import List, Dict, Any, AsyncGenerator, Union, Optional
+from typing import List, Dict, Any, AsyncGenerator, Union, Optional, Tuple
 from enum import Enum
 
+import httpx
 import ollama
 from ollama import ResponseError
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 # Filter out noisy Pydantic warnings coming from LiteLLM/OpenAI internals
 warnings.filterwarnings("ignore", category=UserWarning, module="pydantic")
@@ -44,6 +53,7 @@ def _mask_key(key: Optional[str]) -> str:
 def log_llm_interaction(config: 'LLMConfig', system_prompt: str, messages: List[Dict[str, Any]], response: Union[str, Dict[str, Any]], json_mode: bool):
     """
     Logs the complete LLM interaction to a Markdown file.
+    The entry is formatted here and written by a background thread (see _enqueue_log_entry).
     Includes fail-safe mechanisms to prevent crashing if permissions are wrong.
     """
     # Fail-fast check for write permissions
@@ -52,10 +62,10 @@ def log_llm_interaction(config: 'LLMConfig', system_prompt: str, messages: List[
         return
 
     try:
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
         
         # Combine system prompt and user messages for the final prompt
-        full_prompt_content = system_prompt
+        prompt_parts = [system_prompt]
         for message in messages:
             # CORRECTED: Handle both dict and potential Pydantic object for robustness
             if isinstance(message, dict):
@@ -71,8 +81,9 @@ def log_llm_interaction(config: 'LLMConfig', system_prompt: str, messages: List[
             if name:
                 role_header += f" ({name})"
             
-            full_prompt_content += f"\n\n--- {role_header} ---\n{content}"
-        
+            prompt_parts.append(f"\n\n--- {role_header} ---\n{content}")
+        full_prompt_content = "".join(prompt_parts)
+
         # CORRECTED: Properly extract the response content
         response_content = ""
         if isinstance(response, dict):
@@ -104,16 +115,100 @@ def log_llm_interaction(config: 'LLMConfig', system_prompt: str, messages: List[
 ---
 """
 
-        with log_lock:
-            with open(LOG_FILE, "a", encoding="utf-8") as f:
-                f.write(log_entry)
+        _enqueue_log_entry(log_entry)
 
-    except (PermissionError, OSError):
-        # Silently fail if we can't write, to keep the bot alive
-        pass
     except Exception as e:
         logger.error(f"Failed to write to LLM interaction log: {e}")
 
+# --- Background writer for the interaction log ---
+# log_llm_interaction is called from the event loop after every LLM call. The file
+# append is handed to a single daemon thread so a slow disk never stalls streaming;
+# entries queued while a write is in progress are written together in one append.
+_LOG_QUEUE: "queue.SimpleQueue[str]" = queue.SimpleQueue()
+_log_writer: Optional[threading.Thread] = None
+_log_writer_lock = threading.Lock()
+
+# The log file stays open between writes instead of being reopened for every entry.
+# It is flushed every LOG_FLUSH_EVERY entries, or once the writer has been idle for
+# LOG_FLUSH_INTERVAL_S seconds, so a tail -f on the file lags by at most that much.
+LOG_BUFFER_SIZE = 256 * 1024
+LOG_FLUSH_EVERY = 32
+LOG_FLUSH_INTERVAL_S = 2.0
+_log_fp = None
+_log_unflushed = 0
+_log_last_flush = 0.0
+
+def _flush_log_file() -> None:
+    """Flushes the buffered log file. Caller holds log_lock."""
+    global _log_unflushed, _log_last_flush
+    if _log_fp is not None and _log_unflushed:
+        _log_fp.flush()
+    _log_unflushed = 0
+    _log_last_flush = time.monotonic()
+
+def _write_log_entries(entries: List[str]) -> None:
+    global _log_fp, _log_unflushed
+    with log_lock:
+        try:
+            if _log_fp is None:
+                _log_fp = open(LOG_FILE, "ab", buffering=LOG_BUFFER_SIZE)
+            _log_fp.write("".join(entries).encode("utf-8"))
+            _log_unflushed += len(entries)
+            if _log_unflushed >= LOG_FLUSH_EVERY or time.monotonic() - _log_last_flush > LOG_FLUSH_INTERVAL_S:
+                _flush_log_file()
+        except (PermissionError, OSError):
+            # Silently fail if we can't write, to keep the bot alive.
+            # The handle is dropped (still under the lock) so the next write reopens the file.
+            _close_log_file()
+        except Exception as e:
+            logger.error(f"Failed to write to LLM interaction log: {e}")
+
+def _close_log_file() -> None:
+    """Closes and forgets the log file handle. Caller holds log_lock."""
+    global _log_fp, _log_unflushed
+    fp, _log_fp, _log_unflushed = _log_fp, None, 0
+    if fp is not None:
+        with contextlib.suppress(OSError):
+            fp.close()
+
+def _drain_log_queue(entries: List[str]) -> List[str]:
+    with contextlib.suppress(queue.Empty):
+        while True:
+            entries.append(_LOG_QUEUE.get_nowait())
+    return entries
+
+def _log_writer_loop() -> None:
+    while True:
+        try:
+            first = _LOG_QUEUE.get(timeout=LOG_FLUSH_INTERVAL_S)
+        except queue.Empty:
+            # Idle: push whatever is still buffered to disk
+            with log_lock:
+                try:
+                    _flush_log_file()
+                except OSError:
+                    _close_log_file()
+            continue
+        _write_log_entries(_drain_log_queue([first]))
+
+def _enqueue_log_entry(log_entry: str) -> None:
+    global _log_writer
+    if _log_writer is None:
+        with _log_writer_lock:
+            if _log_writer is None:
+                _log_writer = threading.Thread(target=_log_writer_loop, name="llm-interaction-log", daemon=True)
+                _log_writer.start()
+    _LOG_QUEUE.put(log_entry)
+
+@atexit.register
+def _flush_log_queue() -> None:
+    """Writes entries still queued when the process exits (the writer thread is a daemon) and closes the file."""
+    entries = _drain_log_queue([])
+    if entries:
+        _write_log_entries(entries)
+    with log_lock:
+        _close_log_file()
+
 # --- Constants for LLM Categories ---
 LLM_CATEGORY_DECISIONAL = "decisional"
 LLM_CATEGORY_TOOLS = "tools"
@@ -133,8 +228,22 @@ class LLMProvider(str, Enum):
     # Auto-detect from URL
     AUTO = "auto"
 
+# LiteLLM routes a call by the provider prefix of the model name
+_LITELLM_MODEL_PREFIXES = {
+    LLMProvider.OPENAI_COMPATIBLE: "openai/",  # For custom OpenAI-compatible endpoints
+    LLMProvider.AZURE_OPENAI: "azure/",
+    LLMProvider.GOOGLE: "gemini/",
+    LLMProvider.COHERE: "cohere/",
+    LLMProvider.MISTRAL: "mistral/",
+}
+
 class LLMConfig(BaseModel):
-    """Pydantic model for a resolved LLM configuration."""
+    """
+    Pydantic model for a resolved LLM configuration.
+    Frozen: resolve_llm_config hands the same cached instance to every caller.
+    """
+    model_config = ConfigDict(frozen=True)
+
     server_url: str
     model_name: str
     context_window: int
@@ -142,47 +251,85 @@ class LLMConfig(BaseModel):
     api_key: Optional[str] = None
     custom_headers: Optional[Dict[str, str]] = None
 
+    @functools.cached_property
+    def resolved_model(self) -> str:
+        """Model name as LiteLLM expects it, computed once per (cached) config."""
+        if self.provider == LLMProvider.ANTHROPIC:
+            return self.model_name if self.model_name.startswith("claude-") else f"claude-{self.model_name}"
+        return _LITELLM_MODEL_PREFIXES.get(self.provider, "") + self.model_name
+
+# --- Provider detection rules ---
+# (substrings that must all appear in the lowercased URL, provider), checked in order.
+_PROVIDER_URL_RULES: Tuple[Tuple[Tuple[str, ...], LLMProvider], ...] = (
+    (("api.openai.com",), LLMProvider.OPENAI),
+    (("api.anthropic.com",), LLMProvider.ANTHROPIC),
+    (("openai.azure.com",), LLMProvider.AZURE_OPENAI),
+    (("azure.com", "openai"), LLMProvider.AZURE_OPENAI),
+    (("generativelanguage.googleapis.com",), LLMProvider.GOOGLE),
+    (("googleapis.com", "gemini"), LLMProvider.GOOGLE),
+    (("api.cohere.ai",), LLMProvider.COHERE),
+    (("api.mistral.ai",), LLMProvider.MISTRAL),
+    (("deepseek.com",), LLMProvider.OPENAI_COMPATIBLE),
+    (("together.xyz",), LLMProvider.OPENAI_COMPATIBLE),
+    (("api.perplexity.ai",), LLMProvider.OPENAI_COMPATIBLE),
+)
+_LOCAL_HOST_MARKERS = ("localhost", "127.0.0.1", "host.docker.internal")
+
+@functools.lru_cache(maxsize=256)
 def detect_provider_from_url(server_url: str) -> LLMProvider:
     """
     Detect the LLM provider from the server URL.
+    Cached: a deployment only has a handful of server URLs and every LLM call resolves one.
     """
     if not server_url:
         return LLMProvider.OLLAMA  # Default
     
     server_url_lower = server_url.lower()
-    
-    # Check for known patterns
-    if "api.openai.com" in server_url_lower:
-        return LLMProvider.OPENAI
-    elif "api.anthropic.com" in server_url_lower:
-        return LLMProvider.ANTHROPIC
-    elif "openai.azure.com" in server_url_lower or "azure.com" in server_url_lower and "openai" in server_url_lower:
-        return LLMProvider.AZURE_OPENAI
-    elif "generativelanguage.googleapis.com" in server_url_lower or "googleapis.com" in server_url_lower and "gemini" in server_url_lower:
-        return LLMProvider.GOOGLE
-    elif "api.cohere.ai" in server_url_lower:
-        return LLMProvider.COHERE
-    elif "api.mistral.ai" in server_url_lower:
-        return LLMProvider.MISTRAL
-    elif "deepseek.com" in server_url_lower:
-        return LLMProvider.OPENAI_COMPATIBLE
-    elif "together.xyz" in server_url_lower:
-        return LLMProvider.OPENAI_COMPATIBLE
-    elif "api.perplexity.ai" in server_url_lower:
-        return LLMProvider.OPENAI_COMPATIBLE
-    elif "localhost" in server_url_lower or "127.0.0.1" in server_url_lower or "host.docker.internal" in server_url_lower:
+
+    # Check for known patterns, first match wins
+    for needles, provider in _PROVIDER_URL_RULES:
+        if all(needle in server_url_lower for needle in needles):
+            return provider
+
+    if any(marker in server_url_lower for marker in _LOCAL_HOST_MARKERS):
         # Local endpoints are likely Ollama or local OpenAI-compatible servers
         if "ollama" in server_url_lower or "11434" in server_url:  # Ollama default port
             return LLMProvider.OLLAMA
-        else:
-            return LLMProvider.OPENAI_COMPATIBLE
-    elif server_url_lower.startswith("https://"):
-        # Any HTTPS endpoint is likely an OpenAI-compatible API
-        return LLMProvider.OPENAI_COMPATIBLE
-    else:
-        # Unknown endpoint, assume OpenAI-compatible
         return LLMProvider.OPENAI_COMPATIBLE
 
+    # Any other endpoint (HTTPS or unknown) is assumed OpenAI-compatible
+    return LLMProvider.OPENAI_COMPATIBLE
+
+# --- Per-category settings columns ---
+# (LLMConfig field, column name shared by Bot and GlobalSettings) for each category.
+_CATEGORY_ATTRS: Dict[str, Tuple[Tuple[str, str], ...]] = {
+    LLM_CATEGORY_DECISIONAL: (
+        ("server_url", "decisional_llm_server_url"),
+        ("model_name", "decisional_llm_model"),
+        ("context_window", "decisional_llm_context_window"),
+        ("api_key", "decisional_llm_api_key"),
+    ),
+    LLM_CATEGORY_TOOLS: (
+        ("server_url", "tools_llm_server_url"),
+        ("model_name", "tools_llm_model"),
+        ("context_window", "tools_llm_context_window"),
+        ("api_key", "tools_llm_api_key"),
+    ),
+    LLM_CATEGORY_OUTPUT_CLIENT: (
+        ("server_url", "output_client_llm_server_url"),
+        ("model_name", "output_client_llm_model"),
+        ("context_window", "output_client_llm_context_window"),
+        ("api_key", "output_client_llm_api_key"),
+    ),
+}
+
+# --- Resolved LLMConfig cache ---
+# Bot and global settings rarely change, but every LLM call resolves a config.
+# Keyed by category and the resolved setting values, so an edited setting simply
+# misses the cache; the validated (frozen) LLMConfig is shared between calls.
+LLM_CONFIG_CACHE_MAX_ENTRIES = 256
+_LLM_CONFIG_CACHE: Dict[Tuple[Any, ...], LLMConfig] = {}
+
 def resolve_llm_config(
     bot: Bot,
     global_settings: GlobalSettings,
@@ -193,64 +340,47 @@ def resolve_llm_config(
     settings first, then falling back to global settings.
     Treats empty strings as None to ensure proper fallback.
     """
-    config_map = {
-        LLM_CATEGORY_DECISIONAL: {
-            "server_url": (bot.decisional_llm_server_url, global_settings.decisional_llm_server_url),
-            "model_name": (bot.decisional_llm_model, global_settings.decisional_llm_model),
-            "context_window": (bot.decisional_llm_context_window, global_settings.decisional_llm_context_window),
-            "api_key": (bot.decisional_llm_api_key, global_settings.decisional_llm_api_key),
-        },
-        LLM_CATEGORY_TOOLS: {
-            "server_url": (bot.tools_llm_server_url, global_settings.tools_llm_server_url),
-            "model_name": (bot.tools_llm_model, global_settings.tools_llm_model),
-            "context_window": (bot.tools_llm_context_window, global_settings.tools_llm_context_window),
-            "api_key": (bot.tools_llm_api_key, global_settings.tools_llm_api_key),
-        },
-        LLM_CATEGORY_OUTPUT_CLIENT: {
-            "server_url": (bot.output_client_llm_server_url, global_settings.output_client_llm_server_url),
-            "model_name": (bot.output_client_llm_model, global_settings.output_client_llm_model),
-            "context_window": (bot.output_client_llm_context_window, global_settings.output_client_llm_context_window),
-            "api_key": (bot.output_client_llm_api_key, global_settings.output_client_llm_api_key),
-        }
-    }
-
-    if category not in config_map:
+    category_fields = _CATEGORY_ATTRS.get(category)
+    if category_fields is None:
         raise ValueError(f"Unknown LLM category: {category}")
 
-    category_fields = config_map[category]
-    
     resolved_config = {}
     
     # DEBUG: Log the resolution process
     api_key_source = "None"
 
-    for key, (bot_value, global_value) in category_fields.items():
+    for key, attr in category_fields:
+        bot_value = getattr(bot, attr)
         # Treat empty strings as None for fallback purposes
         if bot_value is not None and bot_value != "":
             resolved_config[key] = bot_value
             if key == "api_key": api_key_source = "Bot"
         else:
+            global_value = getattr(global_settings, attr)
             resolved_config[key] = global_value
             if key == "api_key" and global_value: api_key_source = "Global"
 
     # DEBUG: Log the resolved configuration details
-    masked_key = _mask_key(resolved_config.get('api_key'))
-    logger.info(f"DEBUG resolve_llm_config: Category='{category}', "
-                f"Server='{resolved_config.get('server_url')}', "
-                f"Model='{resolved_config.get('model_name')}', "
-                f"API Key Source={api_key_source}, Key={masked_key}")
-    
-    # Create base config
-    config = LLMConfig(**resolved_config)
-    
-    # Detect provider from URL if not explicitly set
-    if config.provider == LLMProvider.AUTO:
-        config.provider = detect_provider_from_url(config.server_url)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(f"DEBUG resolve_llm_config: Category='{category}', Server='{resolved_config.get('server_url')}', "
+                    f"Model='{resolved_config.get('model_name')}', API Key Source={api_key_source}, "
+                    f"Key={_mask_key(resolved_config.get('api_key'))}")
     
+    cache_key = (category, *resolved_config.values())
+    config = _LLM_CONFIG_CACHE.get(cache_key)
+    if config is None:
+        # Create config, with the provider detected from the URL
+        config = LLMConfig(**resolved_config, provider=detect_provider_from_url(resolved_config["server_url"]))
+        if len(_LLM_CONFIG_CACHE) >= LLM_CONFIG_CACHE_MAX_ENTRIES:
+            _LLM_CONFIG_CACHE.clear()
+        _LLM_CONFIG_CACHE[cache_key] = config
+
     return config
 
 # --- NEW: Message Preparation Helper ---
 
+_SENDER_METADATA_KEYS = frozenset(("name", "user_id"))
+
 def _prepare_messages_for_inference(messages: List[Union[Dict[str, Any], BaseModel]]) -> List[Dict[str, Any]]:
     """
     Prepares messages for the LLM by explicitly injecting the sender's name AND ID into the content.
@@ -258,29 +388,46 @@ def _prepare_messages_for_inference(messages: List[Union[Dict[str, Any], BaseMod
     even if a user changes their display name.
     """
     prepared_messages = []
+    append = prepared_messages.append
     for msg in messages:
-        # Normalize to dict and create a copy to avoid side effects
-        msg_dict = msg.model_dump() if isinstance(msg, BaseModel) else msg.copy()
-        
-        # Inject name and ID into content if present and role is user
-        if msg_dict.get("role") == "user":
-            name = msg_dict.get("name", "Unknown User")
-            user_id = msg_dict.get("user_id")
-            original_content = msg_dict.get("content", "")
-            
-            # Format: "Name (ID: 12345): Message" or "Name: Message"
-            if user_id:
-                msg_dict["content"] = f"{name} (ID: {user_id}): {original_content}"
-            else:
-                msg_dict["content"] = f"{name}: {original_content}"
-            
-            # Remove metadata keys to keep the payload clean for Ollama
-            msg_dict.pop("name", None)
-            msg_dict.pop("user_id", None)
-            
-        prepared_messages.append(msg_dict)
+        # Normalize to dict. ChatMessage keeps its dump cached, other models are dumped here.
+        if isinstance(msg, BaseModel):
+            msg = msg.dumped() if hasattr(msg, "dumped") else msg.model_dump()
+
+        if msg.get("role") != "user":
+            # Shallow copy to avoid side effects on the caller's (or the cached) dict
+            append(dict(msg))
+            continue
+
+        # Inject name and ID into content, and leave the metadata keys out
+        # of the new dict to keep the payload clean for Ollama
+        name = msg.get("name", "Unknown User")
+        user_id = msg.get("user_id")
+        original_content = msg.get("content", "")
+        msg_dict = {key: value for key, value in msg.items() if key not in _SENDER_METADATA_KEYS}
+
+        # Format: "Name (ID: 12345): Message" or "Name: Message"
+        if user_id:
+            msg_dict["content"] = f"{name} (ID: {user_id}): {original_content}"
+        else:
+            msg_dict["content"] = f"{name}: {original_content}"
+        append(msg_dict)
     return prepared_messages
 
+def _build_system_message(config: LLMConfig, system_prompt: str) -> Dict[str, Any]:
+    """
+    Builds the system message sent ahead of the conversation.
+    For Anthropic, the prompt is marked as a cache breakpoint so the provider can skip
+    the prefill of an unchanged system prompt. Ollama and OpenAI-compatible backends
+    reuse identical prefixes on their own, as long as the system prompt stays first.
+    """
+    if config.provider == LLMProvider.ANTHROPIC:
+        return {
+            "role": "system",
+            "content": [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+        }
+    return {"role": "system", "content": system_prompt}
+
 # --- PARAM CALCULATION HELPER (DEEPSEEK FIX) ---
 
 def _get_common_litellm_params(config: LLMConfig, system_prompt: str, json_mode: bool) -> dict:
@@ -332,33 +479,114 @@ def _get_common_litellm_params(config: LLMConfig, system_prompt: str, json_mode:
 
     return extra_params
 
+# --- Ollama Client Registry ---
+# One ollama.AsyncClient (and so one httpx connection pool) per Ollama host, shared by
+# every call: keep-alive connections are reused instead of reconnecting for each request.
+# A pool is bound to the event loop it was created on; the Celery worker runs each task
+# in a fresh asyncio.run loop, so the owning loop is stored and checked too.
+_OLLAMA_CLIENTS: Dict[str, Tuple[asyncio.AbstractEventLoop, ollama.AsyncClient]] = {}
+OLLAMA_POOL_LIMITS = httpx.Limits(max_keepalive_connections=64, max_connections=128)
+# No read timeout (long generations are legitimate), but an unreachable host must fail fast
+# instead of holding a pool slot while the OS-level connect times out.
+OLLAMA_TIMEOUT = httpx.Timeout(None, connect=10.0, pool=30.0)
+# HTTP/2 lets concurrent calls to the same host share one TLS connection. It is only
+# negotiated over TLS (ALPN), so plain http://ollama:11434 hosts stay on HTTP/1.1.
+# httpx needs the optional `h2` package for it.
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+@functools.lru_cache(maxsize=64)
+def _normalize_host(host: str) -> str:
+    """
+    Canonical form of an Ollama host, used as registry/cache key: the same server
+    written as 'http://ollama:11434/' or 'HTTP://ollama:11434' shares one pool.
+    """
+    return str(httpx.URL(host.strip())).rstrip("/")
+
+def _get_ollama_client(host: str) -> ollama.AsyncClient:
+    host = _normalize_host(host)
+    loop = asyncio.get_running_loop()
+    entry = _OLLAMA_CLIENTS.get(host)
+    if entry is not None and entry[0] is loop:
+        return entry[1]
+    use_http2 = _HTTP2_AVAILABLE and host.lower().startswith("https://")
+    client = ollama.AsyncClient(host=host, limits=OLLAMA_POOL_LIMITS, timeout=OLLAMA_TIMEOUT, http2=use_http2)
+    _OLLAMA_CLIENTS[host] = (loop, client)
+    return client
+
+async def close_ollama_clients() -> None:
+    """Closes every pooled Ollama client (and its keep-alive connections). Called on application shutdown."""
+    clients = [client for _, client in _OLLAMA_CLIENTS.values()]
+    _OLLAMA_CLIENTS.clear()
+    for client in clients:
+        try:
+            # ollama.AsyncClient wraps an httpx.AsyncClient in `_client`
+            await client._client.aclose()
+        except Exception as e:
+            logger.debug(f"Error while closing pooled Ollama client: {e}")
+
+# --- Model Residency ---
+# How long Ollama keeps a model loaded after a request (Ollama's own default is 5m).
+# Reloading an evicted model from disk dominates first-token latency of the next turn,
+# so bursty deployments can raise it with OLLAMA_KEEP_ALIVE ("30m", "1h", or seconds;
+# -1 keeps the model loaded indefinitely). Unset: Ollama's default applies.
+def _parse_keep_alive(value: Optional[str]) -> Optional[Union[str, float]]:
+    if not value:
+        return None
+    try:
+        # Bare numbers are seconds and must be sent as JSON numbers
+        return float(value)
+    except ValueError:
+        return value
+
+OLLAMA_KEEP_ALIVE = _parse_keep_alive(os.getenv("OLLAMA_KEEP_ALIVE"))
+
+# --- Transient Connection Retries ---
+# A failed connect means Ollama never saw the request, so retrying is always safe.
+# Errors once a response has started are not retried (the generation may be half done).
+OLLAMA_CONNECT_RETRIES = 2
+# The ollama client re-raises httpx.ConnectError as the builtin ConnectionError
+_CONNECT_ERRORS = (ConnectionError, httpx.ConnectError)
+
+async def _sleep_before_retry(attempt: int, host: str, error: Exception) -> None:
+    """Exponential backoff with jitter, so concurrent callers don't retry in lockstep."""
+    delay = 0.05 * 2 ** attempt + random.uniform(0, 0.05)
+    logger.warning(f"Connection to Ollama at '{host}' failed ({error}), retrying in {delay:.2f}s.")
+    await asyncio.sleep(delay)
+
 # --- Provider-specific client functions ---
 
 async def _call_ollama(
     config: LLMConfig,
     system_prompt: str,
     messages: List[Dict[str, Any]],
-    json_mode: bool = False
+    json_mode: bool = False,
+    json_schema: Optional[Dict[str, Any]] = None
 ) -> str:
-    """Call Ollama API."""
+    """
+    Call Ollama API.
+    With a json_schema, Ollama constrains decoding to that schema (structured outputs),
+    so the model can't emit invalid JSON or spend tokens on prose around it.
+    """
     try:
-        client = ollama.AsyncClient(host=config.server_url)
+        client = _get_ollama_client(config.server_url)
         
         prepared_messages = _prepare_messages_for_inference(messages)
-        full_messages = [{"role": "system", "content": system_prompt}] + prepared_messages
-        
-        request_params = {
-            "model": config.model_name,
-            "messages": full_messages,
-            "options": {
-                "num_ctx": config.context_window
-            }
-        }
-        if json_mode:
-            request_params["format"] = "json"
+        full_messages = [{"role": "system", "content": system_prompt}, *prepared_messages]
 
-        response = await client.chat(**request_params)
-        return response['message']['content']
+        for attempt in range(OLLAMA_CONNECT_RETRIES + 1):
+            try:
+                response = await client.chat(
+                    model=config.model_name,
+                    messages=full_messages,
+                    format=json_schema or ("json" if json_mode else None),
+                    options={"num_ctx": config.context_window},
+                    keep_alive=OLLAMA_KEEP_ALIVE
+                )
+                return response['message']['content']
+            except _CONNECT_ERRORS as e:
+                if attempt == OLLAMA_CONNECT_RETRIES:
+                    raise
+                await _sleep_before_retry(attempt, config.server_url, e)
         
     except ResponseError as e:
         logger.error(f"Ollama API error from '{config.server_url}': {e.status_code} - {e.error}")
@@ -374,21 +602,38 @@ async def _call_ollama_stream(
 ) -> AsyncGenerator[str, None]:
     """Stream from Ollama API."""
     try:
-        client = ollama.AsyncClient(host=config.server_url)
+        client = _get_ollama_client(config.server_url)
         
         prepared_messages = _prepare_messages_for_inference(messages)
-        full_messages = [{"role": "system", "content": system_prompt}] + prepared_messages
-        
-        request_params = {
-            "model": config.model_name,
-            "messages": full_messages,
-            "options": {
-                "num_ctx": config.context_window
-            }
-        }
+        full_messages = [{"role": "system", "content": system_prompt}, *prepared_messages]
+
+        for attempt in range(OLLAMA_CONNECT_RETRIES + 1):
+            stream = await client.chat(
+                model=config.model_name,
+                messages=full_messages,
+                options={"num_ctx": config.context_window},
+                keep_alive=OLLAMA_KEEP_ALIVE,
+                stream=True
+            )
+            # aclosing: if our consumer stops early, the HTTP stream is closed right away,
+            # which makes Ollama abort the generation instead of decoding for nobody.
+            async with contextlib.aclosing(stream):
+                # The request is only sent when the stream is first iterated: a connect
+                # failure surfaces here, before anything was yielded, and can be retried.
+                try:
+                    first_chunk = await anext(stream)
+                except StopAsyncIteration:
+                    return
+                except _CONNECT_ERRORS as e:
+                    if attempt == OLLAMA_CONNECT_RETRIES:
+                        raise
+                    await _sleep_before_retry(attempt, config.server_url, e)
+                    continue
 
-        async for chunk in await client.chat(**request_params, stream=True):
-            yield chunk['message']['content']
+                yield first_chunk['message']['content']
+                async for chunk in stream:
+                    yield chunk['message']['content']
+                return
 
     except ResponseError as e:
         logger.error(f"Ollama API error during stream from '{config.server_url}': {e.status_code} - {e.error}")
@@ -416,29 +661,17 @@ async def _call_litellm(
             final_system_prompt += "\n\nIMPORTANT: Your output MUST be a valid JSON object."
 
         prepared_messages = _prepare_messages_for_inference(messages)
-        full_messages = [{"role": "system", "content": final_system_prompt}] + prepared_messages
+        full_messages = [_build_system_message(config, final_system_prompt), *prepared_messages]
         
-        # Model Name Logic
-        model = config.model_name
-        if config.provider == LLMProvider.OPENAI_COMPATIBLE:
-            # For custom OpenAI-compatible endpoints
-            model = f"openai/{config.model_name}"
-        elif config.provider == LLMProvider.ANTHROPIC:
-             model = f"claude-{config.model_name}" if not config.model_name.startswith("claude-") else config.model_name
-        elif config.provider == LLMProvider.AZURE_OPENAI:
-            model = f"azure/{config.model_name}"
-        elif config.provider == LLMProvider.GOOGLE:
-            model = f"gemini/{config.model_name}"
-        elif config.provider == LLMProvider.COHERE:
-            model = f"cohere/{config.model_name}"
-        elif config.provider == LLMProvider.MISTRAL:
-            model = f"mistral/{config.model_name}"
+        model = config.resolved_model
         
         # Use helper for params
         extra_params = _get_common_litellm_params(config, final_system_prompt, json_mode)
         
         # DEBUG: Log parameters
-        logger.warning(f"DEBUG _call_litellm: Calling '{model}' at '{config.server_url}'. MaxTokens={extra_params.get('max_tokens')}. Key Used: {_mask_key(extra_params.get('api_key'))}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"_call_litellm: Calling '{model}' at '{config.server_url}'. "
+                         f"MaxTokens={extra_params.get('max_tokens')}. Key Used: {_mask_key(extra_params.get('api_key'))}")
 
         # Call LiteLLM (using acompletion for async)
         response = await acompletion(
@@ -468,28 +701,14 @@ async def _call_litellm_stream(
         
         # Prepare messages with system prompt
         prepared_messages = _prepare_messages_for_inference(messages)
-        full_messages = [{"role": "system", "content": system_prompt}] + prepared_messages
+        full_messages = [_build_system_message(config, system_prompt), *prepared_messages]
         
-        # Model Name Logic
-        model = config.model_name
-        if config.provider == LLMProvider.OPENAI_COMPATIBLE:
-            model = f"openai/{config.model_name}"
-        elif config.provider == LLMProvider.ANTHROPIC:
-            model = f"claude-{config.model_name}" if not config.model_name.startswith("claude-") else config.model_name
-        elif config.provider == LLMProvider.AZURE_OPENAI:
-            model = f"azure/{config.model_name}"
-        elif config.provider == LLMProvider.GOOGLE:
-            model = f"gemini/{config.model_name}"
-        elif config.provider == LLMProvider.COHERE:
-            model = f"cohere/{config.model_name}"
-        elif config.provider == LLMProvider.MISTRAL:
-            model = f"mistral/{config.model_name}"
+        model = config.resolved_model
         
         # Use helper for params
         extra_params = _get_common_litellm_params(config, system_prompt, json_mode=False)
         
-        # LOGGING VISIBLE WARNINGS FOR DEBUG
-        logger.warning(f"DEBUG: LiteLLM Stream Start. Model={model}, MaxTokens={extra_params.get('max_tokens')}, CtxWindowDB={config.context_window}")
+        logger.debug(f"LiteLLM Stream Start. Model={model}, MaxTokens={extra_params.get('max_tokens')}, CtxWindowDB={config.context_window}")
 
         # Stream response
         response = await acompletion(
@@ -499,7 +718,9 @@ async def _call_litellm_stream(
             **extra_params
         )
         
-        accumulated_text = ""
+        # The full text is only kept for the debug dump at the end of the stream
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)
+        received_chunks = []
         chunk_count = 0
         
         async for chunk in response:
@@ -514,22 +735,24 @@ async def _call_litellm_stream(
                 content = getattr(delta, 'content', None)
                 if content:
                     # Log first chunk to verify flow
-                    if chunk_count == 0:
-                        logger.warning(f"DEBUG: First chunk received: {repr(content)}")
-                    accumulated_text += content
+                    if debug_enabled:
+                        if chunk_count == 0:
+                            logger.debug(f"First chunk received: {content!r}")
+                        received_chunks.append(content)
                     chunk_count += 1
                     yield content
                 
             except Exception as chunk_error:
-                logger.warning(f"DEBUG: Chunk Error: {chunk_error}")
+                logger.warning(f"LiteLLM stream chunk error: {chunk_error}")
                 continue
         
-        logger.warning(f"DEBUG: Stream finished. Total chunks: {chunk_count}")
-        logger.warning(f"!!! FULL RECEIVED CONTENT !!!\n{repr(accumulated_text)}\n!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
+        if debug_enabled:
+            logger.debug(f"Stream finished. Total chunks: {chunk_count}")
+            logger.debug(f"Full received content:\n{''.join(received_chunks)!r}")
         
         if chunk_count == 0:
              # If successful but empty, it might be the model refusing to speak
-             logger.warning("DEBUG: Empty stream from model.")
+             logger.warning(f"LiteLLM stream from model '{model}' was empty.")
 
     except ImportError:
         logger.error("LiteLLM not installed. Please install with: pip install litellm")
@@ -542,19 +765,45 @@ async def _call_litellm_stream(
 
 # --- Model Listing Functions ---
 
+# --- Ollama Models Cache ---
+# The settings UI lists models every time it renders; the installed models of a
+# host rarely change, so /api/tags results are reused for a short while.
+OLLAMA_MODELS_CACHE_TTL_S = float(os.getenv("OLLAMA_MODELS_CACHE_TTL", "30"))
+_OLLAMA_MODELS_CACHE: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+
+def invalidate_models_cache(server_url: Optional[str] = None) -> None:
+    """Drops the cached model list of a server (or of every server), e.g. after pulling a model."""
+    if server_url is None:
+        _OLLAMA_MODELS_CACHE.clear()
+    else:
+        _OLLAMA_MODELS_CACHE.pop(_normalize_host(server_url), None)
+
 async def list_available_models(server_url: str, api_key: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     List available models from an LLM server.
     Supports both Ollama and cloud providers via LiteLLM.
+    Ollama results are cached per server for OLLAMA_MODELS_CACHE_TTL_S seconds.
     """
     try:
         # Detect provider from URL
         provider = detect_provider_from_url(server_url)
         
         if provider == LLMProvider.OLLAMA:
+            cache_key = _normalize_host(server_url)
+            cached = _OLLAMA_MODELS_CACHE.get(cache_key)
+            if cached and time.monotonic() - cached[0] < OLLAMA_MODELS_CACHE_TTL_S:
+                return cached[1]
+
             # Use Ollama client
-            client = ollama.AsyncClient(host=server_url)
-            response = await client.list()
+            client = _get_ollama_client(server_url)
+            for attempt in range(OLLAMA_CONNECT_RETRIES + 1):
+                try:
+                    response = await client.list()
+                    break
+                except _CONNECT_ERRORS as e:
+                    if attempt == OLLAMA_CONNECT_RETRIES:
+                        raise
+                    await _sleep_before_retry(attempt, server_url, e)
             models_data = response.get('models', [])
             
             # Format for consistency
@@ -566,6 +815,7 @@ async def list_available_models(server_url: str, api_key: Optional[str] = None)
                     "modified_at": model.get("modified_at"),
                     "digest": model.get("digest")
                 })
+            _OLLAMA_MODELS_CACHE[cache_key] = (time.monotonic(), models_list)
             return models_list
             
         else:
@@ -630,24 +880,82 @@ async def list_available_models(server_url: str, api_key: Optional[str] = None)
         logger.error(f"Failed to list models from '{server_url}': {e}", exc_info=True)
         raise
 
+async def unload_ollama_model(server_url: str, model_name: str) -> None:
+    """
+    Asks Ollama to evict a model from memory right away (keep_alive=0) instead of
+    keeping it resident until its idle timeout, freeing VRAM for the models in use.
+    Best effort: failures are only logged.
+    """
+    try:
+        client = _get_ollama_client(server_url)
+        await client.generate(model=model_name, keep_alive=0)
+        logger.info(f"Unloaded Ollama model '{model_name}' from '{server_url}'.")
+    except Exception as e:
+        logger.warning(f"Could not unload Ollama model '{model_name}' from '{server_url}': {e}")
+
 # --- Async LLM Call Functions ---
 
-async def call_llm(
+# --- In-flight Request Coalescing ---
+# Maps request fingerprint -> running LLM call. Identical structured calls of the
+# orchestrator issued while one is already in flight (bursts of Discord events, retried
+# deliveries...) await that call instead of paying another prefill + decode.
+# Only call sites that pass coalesce=True pay for the fingerprint.
+class _SharedCall:
+    """A coalesced LLM call and the number of callers currently awaiting it."""
+    __slots__ = ("key", "task", "waiters")
+
+    def __init__(self, key: str, task: "asyncio.Task[str]"):
+        self.key = key
+        self.task = task
+        self.waiters = 0
+
+    def forget(self) -> None:
+        """Removes the call from _INFLIGHT_CALLS, unless a newer call already took its key."""
+        if _INFLIGHT_CALLS.get(self.key) is self:
+            del _INFLIGHT_CALLS[self.key]
+
+_INFLIGHT_CALLS: Dict[str, _SharedCall] = {}
+
+def _request_fingerprint(
+    config: LLMConfig, system_prompt: str, messages: List[Dict[str, Any]], json_mode: bool,
+    json_schema: Optional[Dict[str, Any]] = None
+) -> str:
+    # Messages are built by the same code on every coalescing call site, so their key
+    # order is stable and sort_keys isn't needed
+    payload = json.dumps(
+        [config.server_url, config.model_name, config.context_window, system_prompt, messages, json_mode, json_schema],
+        default=str
+    )
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+async def _await_shared_call(call: _SharedCall) -> str:
+    call.waiters += 1
+    try:
+        # shield: a cancelled waiter must not cancel the call shared with the others
+        return await asyncio.shield(call.task)
+    finally:
+        call.waiters -= 1
+        if call.waiters == 0 and not call.task.done():
+            # Every waiter was cancelled (client gone, turn torn down): nobody needs the
+            # result, so stop the request instead of keeping the model busy. It is
+            # forgotten right away so a new identical call doesn't join a cancelled one.
+            call.forget()
+            call.task.cancel()
+
+async def _call_llm_uncoalesced(
     config: LLMConfig,
     system_prompt: str,
     messages: List[Dict[str, Any]],
-    json_mode: bool = False
+    json_mode: bool,
+    json_schema: Optional[Dict[str, Any]] = None
 ) -> str:
-    """
-    Makes a specific, on-demand call to an LLM using the provided configuration.
-    Supports multiple providers via LiteLLM.
-    """
-    logger.info(f"Calling LLM: Provider='{config.provider}', Server='{config.server_url}', Model='{config.model_name}', Ctx='{config.context_window}', JSON_Mode={json_mode}")
+    logger.info(f"Calling LLM: Provider='{config.provider}', Server='{config.server_url}', Model='{config.model_name}', "
+                f"Ctx='{config.context_window}', JSON_Mode={json_mode}")
     
     try:
         # Choose the appropriate client based on provider
         if config.provider == LLMProvider.OLLAMA:
-            response = await _call_ollama(config, system_prompt, messages, json_mode)
+            response = await _call_ollama(config, system_prompt, messages, json_mode, json_schema)
         else:
             response = await _call_litellm(config, system_prompt, messages, json_mode)
         
@@ -660,6 +968,38 @@ async def call_llm(
         logger.error(f"Failed to call LLM: {e}", exc_info=True)
         raise
 
+async def call_llm(
+    config: LLMConfig,
+    system_prompt: str,
+    messages: List[Dict[str, Any]],
+    json_mode: bool = False,
+    json_schema: Optional[Dict[str, Any]] = None,
+    coalesce: bool = False
+) -> str:
+    """
+    Makes a specific, on-demand call to an LLM using the provided configuration.
+    Supports multiple providers via LiteLLM.
+    `json_schema` (implies json_mode) constrains Ollama's output to that JSON schema;
+    other providers keep the generic JSON mode, which every backend supports.
+    With `coalesce`, identical JSON-mode calls made concurrently share a single request.
+    """
+    if json_schema:
+        json_mode = True
+    if not (coalesce and json_mode):
+        return await _call_llm_uncoalesced(config, system_prompt, messages, json_mode, json_schema)
+
+    key = _request_fingerprint(config, system_prompt, messages, json_mode, json_schema)
+    call = _INFLIGHT_CALLS.get(key)
+    if call is not None:
+        logger.info("Identical LLM request already in flight, awaiting its result.")
+    else:
+        call = _SharedCall(key, asyncio.ensure_future(
+            _call_llm_uncoalesced(config, system_prompt, messages, json_mode, json_schema)
+        ))
+        _INFLIGHT_CALLS[key] = call
+        call.task.add_done_callback(lambda _: call.forget())
+    return await _await_shared_call(call)
+
 async def call_llm_stream(
     config: LLMConfig,
     system_prompt: str,
@@ -669,7 +1009,8 @@ async def call_llm_stream(
     Makes a specific, on-demand streaming call to an LLM.
     Supports multiple providers via LiteLLM.
     """
-    logger.info(f"Calling LLM Stream: Provider='{config.provider}', Server='{config.server_url}', Model='{config.model_name}', Ctx='{config.context_window}', API Key Present={'Yes' if config.api_key else 'No'}")
+    logger.info(f"Calling LLM Stream: Provider='{config.provider}', Server='{config.server_url}', Model='{config.model_name}', "
+                f"Ctx='{config.context_window}', API Key Present={'Yes' if config.api_key else 'No'}")
     
     # DEBUG: Log which client will be used
     if config.provider == LLMProvider.OLLAMA:
@@ -681,7 +1022,7 @@ async def call_llm_stream(
         else:
             logger.warning(f"DEBUG: No API key provided for {config.provider}")
     
-    full_response_content = ""
+    response_chunks = []
     try:
         # Choose the appropriate streaming client based on provider
         if config.provider == LLMProvider.OLLAMA:
@@ -689,15 +1030,18 @@ async def call_llm_stream(
         else:
             stream_generator = _call_litellm_stream(config, system_prompt, messages)
         
-        async for chunk in stream_generator:
-            full_response_content += chunk
-            yield chunk
+        # Closed explicitly when our own consumer stops early (client disconnect),
+        # instead of whenever the abandoned generator gets finalized.
+        async with contextlib.aclosing(stream_generator):
+            async for chunk in stream_generator:
+                response_chunks.append(chunk)
+                yield chunk
 
     except Exception as e:
         logger.error(f"Failed during LLM streaming: {e}", exc_info=True)
         error_message = "\n\n_An unexpected error occurred while generating the response._"
-        full_response_content += error_message
+        response_chunks.append(error_message)
         yield error_message
     finally:
         # Log the full interaction after the stream is complete
-        log_llm_interaction(config, system_prompt, messages, full_response_content, json_mode=False)
\ No newline at end of file
+        log_llm_interaction(config, system_prompt, messages, "".join(response_chunks), json_mode=False)
\ No newline at end of file
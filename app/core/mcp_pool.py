@@ -0,0 +1,140 @@
+# app/core/mcp_pool.py
+import asyncio
+import functools
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from mcp_use import MCPClient
+
+logger = logging.getLogger(__name__)
+
+# --- Process-wide MCP client pool ---
+# Opening an MCP session (SSE handshake + initialize) costs several round trips.
+# One client per server is kept alive and shared by every orchestrator turn.
+# Maps server_id -> (server url, connected client). The url is kept so that a
+# server whose host/port changed gets a fresh client instead of a stale one.
+_POOL: Dict[int, Tuple[str, MCPClient]] = {}
+_POOL_LOCKS: Dict[int, asyncio.Lock] = {}
+# Loop the pooled clients live on, so discard() can be called from sync (threadpool) code
+_POOL_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+
+def server_key(server_id: int) -> str:
+    """Name of the server entry inside an MCPClient config."""
+    return f"server_{server_id}"
+
+
+@functools.lru_cache(maxsize=256)
+def _server_url(host: str, port: int, rpc_endpoint_path: str) -> str:
+    # FIX: Strip trailing slash which confuses mcp-use discovery
+    return f"http://{host}:{port}{rpc_endpoint_path}".rstrip('/')
+
+
+def build_server_url(server: Any) -> str:
+    """Endpoint URL of an MCPServer. Built once per (host, port, path), every tool call asks for it."""
+    return _server_url(server.host, server.port, server.rpc_endpoint_path)
+
+
+def _build_client_config(server: Any, url: str) -> Dict[str, Any]:
+    return {
+        "mcpServers": {
+            server_key(server.id): {
+                "transport": "sse",
+                "url": url,
+                # FIX: Explicitly disable OAuth to prevent OIDC discovery on MCPHub
+                "oauth": False
+            }
+        }
+    }
+
+
+async def _close_client(client: MCPClient) -> None:
+    try:
+        await client.close_all_sessions()
+    except Exception as e:
+        logger.debug(f"Error while closing pooled MCP client: {e}")
+
+
+def _is_alive(session: Optional[Any]) -> bool:
+    """
+    True if a pooled session can still be used. A server restart drops the SSE
+    stream, and reusing such a session would fail the next call instead of reconnecting.
+    Sessions that don't expose their connection state are assumed alive.
+    """
+    if not session:
+        return False
+    return bool(getattr(session, "is_connected", True))
+
+
+async def get_session(server: Any, timeout: float = 10.0) -> Optional[Any]:
+    """
+    Returns a live MCP session for the given MCPServer, reusing the pooled client
+    when possible and connecting a new one on first use.
+    Raises asyncio.TimeoutError if the connection can't be set up in time.
+    """
+    global _POOL_LOOP
+    _POOL_LOOP = asyncio.get_running_loop()
+    url = build_server_url(server)
+    async with _POOL_LOCKS.setdefault(server.id, asyncio.Lock()):
+        entry = _POOL.pop(server.id, None)
+        if entry:
+            pooled_url, pooled_client = entry
+            if pooled_url == url:
+                session = pooled_client.get_session(server_key(server.id))
+                if _is_alive(session):
+                    _POOL[server.id] = entry
+                    return session
+                logger.info(f"Pooled MCP session for server {server.id} is closed, reconnecting.")
+            await _close_client(pooled_client)
+
+        client = MCPClient(_build_client_config(server, url))
+        try:
+            await asyncio.wait_for(client.create_all_sessions(), timeout=timeout)
+        except BaseException:
+            # Don't leak the SSE streams a half-finished connection may have opened
+            await _close_client(client)
+            raise
+        _POOL[server.id] = (url, client)
+        return client.get_session(server_key(server.id))
+
+
+async def invalidate(server_id: int, session: Optional[Any] = None) -> None:
+    """
+    Drops (and closes) the pooled client of a server, e.g. after a network error.
+    Pass the session the error happened on: the client is shared by concurrent turns,
+    so it is only dropped if it still holds that session and the session no longer
+    reports itself connected. Without a session the client is dropped unconditionally.
+    """
+    async with _POOL_LOCKS.setdefault(server_id, asyncio.Lock()):
+        entry = _POOL.get(server_id)
+        if not entry:
+            return
+        client = entry[1]
+        if session is not None:
+            if client.get_session(server_key(server_id)) is not session:
+                # Already replaced by another caller
+                return
+            if getattr(session, "is_connected", None) is True:
+                # The error didn't break the connection: the other in-flight calls keep it
+                return
+        del _POOL[server_id]
+    await _close_client(client)
+
+
+def discard(server_id: int) -> None:
+    """
+    Drops the pooled client of a deleted server. Safe to call from sync code running
+    in a threadpool: the close is scheduled on the loop that owns the pool.
+    """
+    loop = _POOL_LOOP
+    if server_id not in _POOL or loop is None or loop.is_closed():
+        return
+    asyncio.run_coroutine_threadsafe(invalidate(server_id), loop)
+
+
+async def close_all() -> None:
+    """Closes every pooled client. Called on application shutdown."""
+    entries = list(_POOL.values())
+    _POOL.clear()
+    for _, client in entries:
+        await _close_client(client)
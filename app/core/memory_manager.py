@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from typing import Dict, Any, List, Optional
 import os
@@ -21,6 +22,14 @@ class MemoryManager:
         """
         Instancie un client Mem0 configuré avec les bons paramètres de fournisseur.
         """
+        return MemoryManager.create_memory_client(MemoryManager.build_memory_config(bot, global_settings))
+
+    @staticmethod
+    def build_memory_config(bot: sql_models.Bot, global_settings: sql_models.GlobalSettings) -> Dict[str, Any]:
+        """
+        Construit la configuration Mem0 du bot.
+        Lit les objets ORM : à appeler sur le thread qui possède la session SQLAlchemy.
+        """
         
         # 1. Résolution de la config LLM pour l'extraction de faits
         llm_config = llm_manager.resolve_llm_config(bot, global_settings, llm_manager.LLM_CATEGORY_TOOLS)
@@ -86,8 +95,14 @@ class MemoryManager:
             }
         
         mem0_config["llm"] = provider_config
+        return mem0_config
 
-        # 5. Instanciation
+    @staticmethod
+    def create_memory_client(mem0_config: Dict[str, Any]) -> Optional[Memory]:
+        """
+        Instancie le client Mem0 à partir d'une configuration déjà résolue.
+        Bloquant (connexion Chroma) mais sans accès ORM : peut tourner dans un thread.
+        """
         try:
             return Memory.from_config(mem0_config)
         except Exception as e:
@@ -134,6 +149,7 @@ class MemoryManager:
             
         try:
             # Mem0 effectue un appel LLM ici pour extraire les faits, c'est pourquoi c'est asynchrone dans notre orchestrateur
-            memory_client.add(user_message, user_id=user_id, metadata={"role": "user"})
+            # L'appel est bloquant : il tourne dans un thread pour ne pas geler la boucle d'événements
+            await asyncio.to_thread(memory_client.add, user_message, user_id=user_id, metadata={"role": "user"})
         except Exception as e:
             logger.error(f"Error adding interaction to memory: {e}")
\ No newline at end of file
@@ -1,5 +1,6 @@
+import time
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional, Tuple
 from app.database.sql_models import GlobalSettings, LLMEvaluationRun
 from app.schemas.settings_schema import (
     GlobalSettingsUpdate,
@@ -26,6 +27,36 @@ def get_global_settings(db: Session) -> GlobalSettingsSchema:
     return db_settings
 
 
+# --- Global Settings Snapshot Cache ---
+# Every chat turn reads the global settings (LLM fallbacks) but they almost never change.
+# A detached, fully loaded snapshot is reused for a short TTL; saving the settings in
+# this process drops it immediately, other processes pick the change up within the TTL.
+GLOBAL_SETTINGS_CACHE_TTL_S = 30.0
+_GLOBAL_SETTINGS_CACHE: Optional[Tuple[float, GlobalSettings]] = None
+
+
+def get_global_settings_cached(db: Session) -> GlobalSettingsSchema:
+    """
+    Read-only variant of get_global_settings for hot paths.
+    The returned instance is detached from the session: don't modify it.
+    """
+    global _GLOBAL_SETTINGS_CACHE
+    now = time.monotonic()
+    cached = _GLOBAL_SETTINGS_CACHE
+    if cached and now - cached[0] < GLOBAL_SETTINGS_CACHE_TTL_S:
+        return cached[1]
+
+    db_settings = get_global_settings(db)
+    db.expunge(db_settings)
+    _GLOBAL_SETTINGS_CACHE = (now, db_settings)
+    return db_settings
+
+
+def invalidate_global_settings_cache() -> None:
+    global _GLOBAL_SETTINGS_CACHE
+    _GLOBAL_SETTINGS_CACHE = None
+
+
 def save_global_settings(db: Session, settings_update: GlobalSettingsUpdate) -> GlobalSettingsSchema:
     """
     Updates the global settings of the application.
@@ -44,6 +75,7 @@ def save_global_settings(db: Session, settings_update: GlobalSettingsUpdate) ->
             
     db.commit()
     db.refresh(db_settings)
+    invalidate_global_settings_cache()
     
     return db_settings
 
@@ -23,6 +23,7 @@ from app.api import (
 )
 from app.api.mcp_api import background_discovery_task
 from app.core.websocket_manager import websocket_manager
+from app.core import llm_manager, mcp_pool
 from app.database import sql_session
 from app.database.sql_session import engine
 
@@ -60,6 +61,9 @@ async def lifespan(app: FastAPI):
     
     # --- Logique d'Arrêt ---
     logger.info("Application shutdown...")
+    await chat_api.shutdown_archive_tasks()
+    await mcp_pool.close_all()
+    await llm_manager.close_ollama_clients()
 
 
 app = FastAPI(lifespan=lifespan)
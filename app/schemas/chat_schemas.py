@@ -1,7 +1,7 @@
 """
 Pydantic schemas for chat interactions, supporting the new agent chain architecture.
 """
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 from typing import List, Dict, Any, Optional, Literal
 
 # region: API Request Schemas
@@ -13,6 +13,36 @@ class ChatMessage(BaseModel):
     content: str
     name: Optional[str] = None
 
+    # Serialized form, computed once and shared by every agent of the turn.
+    # Reset on every path that creates or changes an instance: construction
+    # (including model_construct), field assignment and copies (model_copy(update=...)
+    # writes the update straight into the copy's __dict__).
+    _dumped: Optional[Dict[str, Any]] = PrivateAttr(default=None)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._dumped = None
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name in type(self).model_fields:
+            self._dumped = None
+        super().__setattr__(name, value)
+
+    def __copy__(self) -> "ChatMessage":
+        copied = super().__copy__()
+        copied._dumped = None
+        return copied
+
+    def __deepcopy__(self, memo: Optional[Dict[int, Any]] = None) -> "ChatMessage":
+        copied = super().__deepcopy__(memo)
+        copied._dumped = None
+        return copied
+
+    def dumped(self) -> Dict[str, Any]:
+        """Returns the cached model_dump() of this message. Treat it as read-only."""
+        if self._dumped is None:
+            self._dumped = self.model_dump()
+        return self._dumped
+
 class ProcessMessageRequest(BaseModel):
     """Request body for the main chat processing endpoint."""
     bot_id: int
@@ -25,6 +55,14 @@ class ProcessMessageRequest(BaseModel):
     is_direct_message: bool = False
     is_direct_mention: bool = False # NEW: Flag to indicate a direct mention or reply
 
+def dump_chat_history(history: List[ChatMessage]) -> List[Dict[str, Any]]:
+    """
+    Serializes a whole conversation to plain dicts (the format the LLM calls expect).
+    Each message is dumped once and cached on the message, so the several agents that
+    see the same history in a turn don't re-serialize it. The dicts are shared: don't mutate them.
+    """
+    return [msg.dumped() for msg in history]
+
 # endregion
 
 # region: Agent & Plan Schemas
@@ -65,6 +103,9 @@ class PlannerResult(BaseModel):
     """Schema for the Planner's output."""
     plan: List[PlanStep] = []
 
+class ExtractAndPlanResult(ParameterExtractorResult, PlannerResult):
+    """Schema for the combined Parameter Extractor + Planner output (single LLM call)."""
+
 # endregion
 
 # region: API Response Schemas
@@ -1,7 +1,16 @@
+import asyncio
 import os
 from celery import Celery
 from celery.schedules import crontab
 
+# Les tâches exécutent leur code async via asyncio.run : on leur donne la boucle uvloop
+# (fournie par uvicorn[standard]), comme pour l'API. Repli sur asyncio si absente.
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
+
 # Récupérer l'URL du broker depuis les variables d'environnement
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL")
 
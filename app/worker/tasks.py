@@ -16,7 +16,7 @@ from mcp_use import MCPClient
 
 from app.database.sql_session import SessionLocal
 from app.database import crud_user_notes, crud_workflows, crud_mcp, crud_bots, crud_settings
-from app.database.sql_models import LLMEvaluationRun, Workflow, Trigger
+from app.database.sql_models import Bot, GlobalSettings, LLMEvaluationRun, Workflow, Trigger
 from app.schemas import chat_schemas
 from app.core.agents.archivist import run_archivist
 from app.core import llm_manager
@@ -306,6 +306,15 @@ async def _run_single_evaluation_case(config: llm_manager.LLMConfig, test_case:
         "response": response_content[:500] 
     }
 
+def _configured_model_names(db: Session) -> set:
+    """Every model name configured globally or on a bot, for any LLM category."""
+    columns = ("decisional_llm_model", "tools_llm_model", "output_client_llm_model", "multimodal_llm_model")
+    names = set()
+    for model in (GlobalSettings, Bot):
+        for row in db.query(*(getattr(model, column) for column in columns)).all():
+            names.update(name for name in row if name)
+    return names
+
 @shared_task(bind=True)
 def run_llm_evaluation(self, evaluation_request_data: dict):
     # ... (Unchanged logic for evaluation task)
@@ -357,6 +366,12 @@ def run_llm_evaluation(self, evaluation_request_data: dict):
         evaluation_run.completed_at = datetime.utcnow()
         db.commit()
 
+        # A model evaluated but not used by any bot would otherwise stay in VRAM until
+        # Ollama's idle timeout, competing with the models actually serving chats.
+        if (llm_manager.detect_provider_from_url(request_data.llm_server_url) == llm_manager.LLMProvider.OLLAMA
+                and request_data.llm_model_name not in _configured_model_names(db)):
+            asyncio.run(llm_manager.unload_ollama_model(request_data.llm_server_url, request_data.llm_model_name))
+
     except Exception as e:
         logger.error(f"LLM evaluation task failed: {e}")
         if db.is_active:
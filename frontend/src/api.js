@@ -21,13 +21,19 @@ export async function fetchWithAuth(url, options = {}) {
 /**
  * Fetches the list of available LLM models from the backend.
  * @param {string|null} ollamaUrl - An optional Ollama URL to test.
+ * @param {boolean} refresh - Bypass the server-side cache of the models list.
  * @returns {Promise<Array<object>>} - A list of model objects.
  */
-export async function fetchModels(ollamaUrl = null) {
-    let url = `${API_BASE_URL}/settings/llm/models`;
+export async function fetchModels(ollamaUrl = null, refresh = false) {
+    const params = new URLSearchParams();
     if (ollamaUrl) {
-        url += `?ollama_url=${encodeURIComponent(ollamaUrl)}`;
+        params.set('ollama_url', ollamaUrl);
     }
+    if (refresh) {
+        params.set('refresh', 'true');
+    }
+    const query = params.toString();
+    const url = `${API_BASE_URL}/settings/llm/models${query ? `?${query}` : ''}`;
     const response = await fetchWithAuth(url);
     if (!response.ok) {
         const errorData = await response.json();
@@ -288,7 +288,7 @@ export function populateModelDropdown(selectTarget, selectedValue, availableMode
 
     if (forceRefresh) {
         showSpinner();
-        fetchModels(ollamaUrl)
+        fetchModels(ollamaUrl, true)
             .then(models => {
                 _populateWithOptions(select, models, selectedValue);
                 showToast("LLM models list refreshed.", "success");